@@ -0,0 +1,323 @@
+# bench_redactor.py
+#
+# Reproducible throughput and latency benchmarks for the redactors and for
+# end-to-end runs of redactor.py on a synthetic email corpus.
+#
+#   python benchmarks/bench_redactor.py --docs 200 --doc-size 4000 --output bench.json
+#   python benchmarks/bench_redactor.py --output new.json --compare bench.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import redactor  # noqa: E402
+
+FIRST_NAMES = ['John', 'Jane', 'Phillip', 'Emily', 'Robert', 'Maria', 'David', 'Susan', 'Michael', 'Linda']
+LAST_NAMES = ['Doe', 'Smith', 'Allen', 'Thompson', 'Johnson', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore']
+STREETS = ['Main', 'Elm', 'Oak', 'Maple', 'Pine', 'Cedar']
+STREET_TYPES = ['St', 'Street', 'Ave', 'Road', 'Blvd', 'Lane']
+CITIES = [('Springfield', 'IL', '62704'), ('New York', 'NY', '10001'), ('Houston', 'TX', '77002')]
+MONTHS = ['Jan', 'February', 'Mar', 'April', 'May', 'Jun', 'July', 'Aug', 'September', 'Oct', 'Nov', 'December']
+CONCEPT_SENTENCES = [
+    'We went to the beach last summer.',
+    'Summertime brings long warm evenings.',
+    'The summer schedule starts in June.',
+]
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri']
+DISCLAIMER = (
+    'This e-mail is the property of Enron Corp. and may contain confidential information. '
+    'If you are not the intended recipient, please contact the sender at 713-853-6161 and delete all copies.'
+)
+FILLER_SENTENCES = [
+    'Please review the attached report before the meeting.',
+    'The trading desk closed higher than expected today.',
+    'Let me know if the numbers in the spreadsheet look right.',
+    'We need to finalize the contract terms this week.',
+    'The pipeline capacity figures were updated this morning.',
+]
+
+# Redactor benchmarks: name -> (redactor function, extra arguments, equivalent redaction options)
+REDACTOR_CASES = {
+    'names': ('mask_names_in_text', (), {'names': True}),
+    'dates': ('redact_dates', (), {'dates': True}),
+    'phones': ('mask_phone_numbers_in_text', (), {'phones': True}),
+    'addresses': ('mask_detected_addresses', (), {'address': True}),
+    'concepts': ('mask_concept_related_text', (['summer'],), {'concepts': ['summer']}),
+}
+
+# End-to-end runs of redactor.py: name -> command line flags
+CLI_CASES = {
+    'cli_phones': ['--phones'],
+    'cli_address': ['--address', '--gnlp-backend', 'local'],
+    'cli_all': ['--names', '--dates', '--phones', '--address', '--gnlp-backend', 'local', '--concept', 'summer'],
+}
+
+
+def random_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def random_email(rng):
+    return f'{rng.choice(FIRST_NAMES).lower()}.{rng.choice(LAST_NAMES).lower()}@enron.com'
+
+
+def random_date(rng):
+    style = rng.randrange(3)
+    if style == 0:
+        return f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1998, 2024)}'
+    if style == 1:
+        return f'{rng.choice(MONTHS)} {rng.randint(1, 28)}, {rng.randint(1998, 2024)}'
+    return f'{rng.randint(1, 12)}/{rng.randint(1, 28)}'
+
+
+def random_phone(rng):
+    if rng.random() < 0.5:
+        return f'{rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}'
+    return f'+1 ({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}'
+
+
+def random_address(rng):
+    city, state, zip_code = rng.choice(CITIES)
+    return f'{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(STREET_TYPES)}., {city}, {state} {zip_code}'
+
+
+def random_body_sentence(rng):
+    roll = rng.random()
+    if roll < 0.15:
+        return f'{random_name(rng)} will join the call on {random_date(rng)}.'
+    if roll < 0.25:
+        return f'You can reach me at {random_phone(rng)} after lunch.'
+    if roll < 0.32:
+        return f'Send the package to {random_address(rng)} by Friday.'
+    if roll < 0.40:
+        return rng.choice(CONCEPT_SENTENCES)
+    return rng.choice(FILLER_SENTENCES)
+
+
+def random_header_date(rng):
+    return (f'{rng.choice(WEEKDAYS)}, {rng.randint(1, 28)} {rng.choice(MONTHS)[:3]} {rng.randint(1998, 2002)} '
+            f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00 -0700 (PDT)')
+
+
+def generate_email(rng, size):
+    # One synthetic email with headers from redactor.EMAIL_HEADERS and a body of
+    # roughly `size` characters. Some emails quote an earlier message or end
+    # with the same disclaimer, as corporate mail does.
+    sender = random_name(rng)
+    recipient = random_name(rng)
+    header_values = {
+        'From:': random_email(rng),
+        'To:': random_email(rng),
+        'Cc:': random_email(rng),
+        'Bcc:': random_email(rng),
+        'Subject:': 'Re: ' + rng.choice(FILLER_SENTENCES).rstrip('.'),
+        'X-From:': sender,
+        'X-To:': recipient,
+        'X-cc:': '',
+        'X-bcc:': '',
+        'X-Folder:': '\\Notes Folders\\Sent',
+        'X-Origin:': sender.split()[-1] + '-' + sender.split()[0][0],
+        'X-FileName:': sender.split()[0].lower() + '.nsf',
+    }
+    lines = [f'Message-ID: <{rng.randint(10 ** 7, 10 ** 8)}.JavaMail.evans@thyme>', f'Date: {random_header_date(rng)}']
+    lines.extend(f'{header} {header_values[header]}'.rstrip() for header in redactor.EMAIL_HEADERS)
+    lines.append('')
+    body = []
+    length = 0
+    while length < size:
+        paragraph = ' '.join(random_body_sentence(rng) for _ in range(rng.randint(2, 5)))
+        body.append(paragraph)
+        length += len(paragraph) + 2
+    lines.append('\n\n'.join(body))
+    lines.append(f'\n{sender.split()[0]}')
+    if rng.random() < 0.5:
+        lines.append('')
+        lines.append(' -----Original Message-----')
+        lines.append(f'From: \t{recipient}  ')
+        lines.append(f'Sent:\t{random_header_date(rng)}')
+        lines.append(f'To:\t{sender}')
+        lines.append(f"Subject:\t{header_values['Subject:'][4:]}")
+        lines.append('')
+        lines.append(rng.choice(body))
+    if rng.random() < 0.5:
+        lines.append('')
+        lines.append(DISCLAIMER)
+    return '\n'.join(lines) + '\n'
+
+
+def generate_corpus(docs, doc_size, seed=0):
+    # A reproducible list of synthetic emails.
+    rng = random.Random(seed)
+    return [generate_email(rng, doc_size) for _ in range(docs)]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def peak_rss_mb(usage):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+
+def summarize(docs, total_bytes, wall_time, usage, latencies=None):
+    # Latency percentiles are None when per-document times were not measured.
+    return {
+        'docs': docs,
+        'megabytes': total_bytes / 1e6,
+        'seconds': wall_time,
+        'docs_per_sec': docs / wall_time if wall_time else 0.0,
+        'mb_per_sec': total_bytes / 1e6 / wall_time if wall_time else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'peak_rss_mb': peak_rss_mb(usage),
+    }
+
+
+def run_redactor_case(name, corpus, model):
+    # Time one redactor over the corpus, document by document. Runs in a fresh
+    # process so the peak RSS belongs to this case alone.
+    function_name, extra_args, options = REDACTOR_CASES[name]
+    function = getattr(redactor, function_name)
+    redactor.configure_nlp(model=model, exclude=redactor.pipeline_exclusions(**options))
+    # Addresses are looked up with the offline stand-in for the Google NLP service
+    redactor.configure_gnlp(backend='local', concurrency=1)
+    redactor.warm_up(options)
+
+    latencies = []
+    start = time.perf_counter()
+    for text in corpus:
+        doc_start = time.perf_counter()
+        function(text, *extra_args)
+        latencies.append(time.perf_counter() - doc_start)
+    wall_time = time.perf_counter() - start
+
+    total_bytes = sum(len(text.encode('utf-8')) for text in corpus)
+    return summarize(len(corpus), total_bytes, wall_time, resource.getrusage(resource.RUSAGE_SELF), latencies)
+
+
+def run_cli_case(name, corpus_dir, total_bytes, doc_count, model, extra_args):
+    # Time a full redactor.py run over the corpus directory.
+    with tempfile.TemporaryDirectory() as output_dir:
+        command = [
+            sys.executable, os.path.join(REPO_DIR, 'redactor.py'),
+            '--input', os.path.join(corpus_dir, '*.txt'),
+            '--output', output_dir,
+            '--stats', os.path.join(output_dir, 'stats.json'),
+            '--model', model,
+        ] + CLI_CASES[name] + extra_args
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        stderr = process.stderr.read().decode('utf-8', 'replace')
+        process.stderr.close()
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f'{name} failed: {stderr.strip()}')
+    # Per-document latency is not observable from outside (profiling it would
+    # turn off batched parsing), so only throughput is reported
+    result = summarize(doc_count, total_bytes, wall_time, usage)
+    result['command'] = ' '.join(CLI_CASES[name] + extra_args)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    # Print the throughput change of every benchmark present in both result sets.
+    print(f"{'benchmark':<14} {'docs/sec':>10} {'baseline':>10} {'change':>8}")
+    for name, result in results['benchmarks'].items():
+        old = baseline.get('benchmarks', {}).get(name)
+        if not old or 'error' in result or 'error' in old or not old['docs_per_sec']:
+            continue
+        change = result['docs_per_sec'] / old['docs_per_sec'] - 1
+        print(f"{name:<14} {result['docs_per_sec']:>10.1f} {old['docs_per_sec']:>10.1f} {change:>+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the redactors and the redactor.py command line.')
+    parser.add_argument('--docs', type=int, default=100, help='Number of synthetic documents.')
+    parser.add_argument('--doc-size', type=int, default=3000, help='Approximate body size of each document in characters.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the corpus generator.')
+    parser.add_argument('--model', default='en_core_web_lg', help='spaCy model for the name, date and concept benchmarks.')
+    parser.add_argument('--only', action='append', choices=sorted(REDACTOR_CASES) + sorted(CLI_CASES),
+                        help='Benchmark(s) to run. Can be repeated; all run by default.')
+    parser.add_argument('--cli-args', default='',
+                        help='Extra arguments appended to every redactor.py run, e.g. "--workers 4".')
+    parser.add_argument('--output', help='File to save the results to as JSON.')
+    parser.add_argument('--compare', help='Results JSON from an earlier run to compare throughput against.')
+    args = parser.parse_args()
+
+    selected = args.only or list(REDACTOR_CASES) + list(CLI_CASES)
+    corpus = generate_corpus(args.docs, args.doc_size, seed=args.seed)
+    total_bytes = sum(len(text.encode('utf-8')) for text in corpus)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'docs': args.docs, 'doc_size': args.doc_size, 'seed': args.seed, 'model': args.model},
+        'benchmarks': {},
+    }
+
+    context = multiprocessing.get_context('spawn')
+    for name in selected:
+        if name not in REDACTOR_CASES:
+            continue
+        try:
+            with context.Pool(processes=1) as pool:
+                results['benchmarks'][name] = pool.apply(run_redactor_case, (name, corpus, args.model))
+        except Exception as e:
+            results['benchmarks'][name] = {'error': str(e)}
+        print(name, json.dumps(results['benchmarks'][name]), file=sys.stderr)
+
+    cli_selected = [name for name in selected if name in CLI_CASES]
+    if cli_selected:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            for i, text in enumerate(corpus):
+                with open(os.path.join(corpus_dir, f'mail_{i:06d}.txt'), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            for name in cli_selected:
+                try:
+                    results['benchmarks'][name] = run_cli_case(
+                        name, corpus_dir, total_bytes, len(corpus), args.model, args.cli_args.split())
+                except Exception as e:
+                    results['benchmarks'][name] = {'error': str(e)}
+                print(name, json.dumps(results['benchmarks'][name]), file=sys.stderr)
+
+    results_json = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(results_json)
+    else:
+        print(results_json)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
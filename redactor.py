@@ -3,23 +3,305 @@
 import argparse
 import sys
 import os
+import gzip
+import bz2
+import lzma
+import queue
 import glob
 import json
-import spacy
+import multiprocessing
+import functools
 import re
-from google.cloud import language_v1
+import bisect
+import io
+import time
+import hashlib
+import zlib
+import sqlite3
+import threading
+import contextlib
+import tracemalloc
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import deque
+from collections import namedtuple
+from collections import OrderedDict
 from warnings import filterwarnings
 
 filterwarnings("ignore", category=SyntaxWarning)
-# print('Loading spaCy model...')
-nlp = spacy.load('en_core_web_lg')
-# print('spaCy model loaded.')
+
+# The spaCy model is loaded on first use, so runs that only need regex-based
+# redactors never pay for it; see configure_nlp.
+nlp_settings = {
+    'model': 'en_core_web_lg',
+    'exclude': (),
+}
+_nlp = None
+
+# Components that none of the redactors read from.
+UNUSED_COMPONENTS = ('tagger', 'attribute_ruler', 'lemmatizer', 'senter')
+
+
+def pipeline_exclusions(names=False, dates=False, concepts=None, **options):
+    # Pipeline components that can be left out for the enabled redactors. Names
+    # and dates read entities from the NER; concepts need sentences from the parser.
+    exclude = list(UNUSED_COMPONENTS)
+    if not (names or needs_date_ner(names=names, dates=dates, concepts=concepts)):
+        exclude.append('ner')
+    if not concepts:
+        exclude.append('parser')
+    return tuple(exclude)
+
+
+def configure_nlp(model=None, exclude=None):
+    # Choose the spaCy model and the components to leave out. Takes effect the
+    # next time the model is needed.
+    global _nlp
+    if model is not None:
+        nlp_settings['model'] = model
+    if exclude is not None:
+        nlp_settings['exclude'] = tuple(exclude)
+    _nlp = None
+    get_concept_vectors.cache_clear()
+
+
+# Word vectors shared between processes: when 'path' is set, the vector
+# table of the model is exported there once as a .npy file and every process
+# maps it read-only instead of loading its own copy.
+vectors_settings = {
+    'path': None,
+}
+
+
+def configure_vectors(path=None):
+    # Share the model's word vectors through a memory-mapped file at path (None to stop).
+    vectors_settings['path'] = path or None
+    configure_nlp()
+
+
+def export_vectors(vocab_dir, path, identity):
+    # Copy the vector table of a model vocab to a little-endian float32 .npy
+    # file at path, block by block so it is never held in memory, with the
+    # identity of the model next to it in path + '.json'.
+    import numpy
+    source = numpy.load(os.path.join(vocab_dir, 'vectors'), mmap_mode='r')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    target = numpy.lib.format.open_memmap(temp_path, mode='w+', dtype='<f4', shape=source.shape)
+    for start in range(0, source.shape[0], 65536):
+        target[start:start + 65536] = source[start:start + 65536]
+    target.flush()
+    del target
+    os.replace(temp_path, path)
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(identity, shape=list(source.shape)), f)
+    os.replace(temp_path, path + '.json')
+
+
+def vectors_exported(path, identity):
+    # Whether the vector table at path was exported from the model identified
+    # by identity, going by the model name and version saved next to it.
+    try:
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            exported = json.load(f)
+        return os.path.exists(path) and all(exported.get(key) == value for key, value in identity.items())
+    except (OSError, ValueError):
+        return False
+
+
+def attach_shared_vectors(nlp, path):
+    # Give a model loaded without its vectors a read-only memory map of the
+    # exported vector table, exporting it first when it is missing or was
+    # exported from another model. The pages are shared by every process
+    # that maps the file, forked or not.
+    import fcntl
+    import numpy
+    vocab_dir = os.path.join(nlp.path, 'vocab')
+    if not os.path.exists(os.path.join(vocab_dir, 'vectors')):
+        return
+    identity = {'model': nlp_settings['model'], 'name': nlp.meta.get('name'), 'version': nlp.meta.get('version')}
+    if not vectors_exported(path, identity):
+        # Workers starting together export once: the others wait for the
+        # lock and find the table current when they get it
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not vectors_exported(path, identity):
+                export_vectors(vocab_dir, path, identity)
+
+    vectors = nlp.vocab.vectors
+    # The key to row table and settings are small and read as usual
+    vectors.from_disk(vocab_dir, exclude=('strings', 'vectors'))
+    vectors.data = numpy.load(path, mmap_mode='r')
+
+
+def get_nlp():
+    # Load the configured spaCy model on first use, adding the date patterns
+    # to the entity ruler in front of the NER.
+    global _nlp
+    if _nlp is None:
+        import spacy
+        # print('Loading spaCy model...')
+        exclude = list(nlp_settings['exclude'])
+        if vectors_settings['path']:
+            exclude.append('vectors')
+        nlp = spacy.load(nlp_settings['model'], exclude=exclude)
+        if vectors_settings['path']:
+            attach_shared_vectors(nlp, vectors_settings['path'])
+        if 'ner' in nlp.pipe_names:
+            ruler = nlp.add_pipe("entity_ruler", before="ner")
+            ruler.add_patterns(dict_for_date_match)
+        _nlp = nlp
+        # print('spaCy model loaded.')
+    return _nlp
 
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'data-engineering-434614-245ce8e4d3e0.json'
 EMAIL_HEADERS = ['From:', 'To:', 'Cc:', 'Bcc:', 'Subject:', 'X-From:', 'X-To:', 'X-cc:', 'X-bcc:', 'X-Folder:', 'X-Origin:', 'X-FileName:']
 
 
 
+# Opt-in per-stage profiling (--profile). Stages run inside collect_profile()
+# add their wall time, CPU time, call count and peak traced memory to that
+# profile; profile_hooks are called with (file_path, profile) for every file.
+profiling = {
+    'enabled': False,
+    'memory': False,
+}
+profile_hooks = []
+_profile_local = threading.local()
+
+
+def add_profile_hook(hook):
+    # Subscribe to per-file profiles. hook(file_path, profile) is called in the
+    # main process once a file has been redacted and written.
+    profile_hooks.append(hook)
+
+
+def configure_profiling(enabled=True, memory=True):
+    # Turn stage profiling on or off; memory tracking uses tracemalloc.
+    profiling['enabled'] = enabled
+    profiling['memory'] = enabled and memory
+    if profiling['memory'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not profiling['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def collect_profile(profile=None):
+    # Gather the stages run on this thread into a profile dict (a new one
+    # unless one is passed in). Yields None when profiling is off.
+    if not profiling['enabled']:
+        yield None
+        return
+    profile = {} if profile is None else profile
+    previous = getattr(_profile_local, 'profile', None)
+    _profile_local.profile = profile
+    try:
+        yield profile
+    finally:
+        _profile_local.profile = previous
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    # Time one stage into the profile being collected on this thread, if any.
+    # Peak memory is the highest traced allocation above the stage's starting
+    # point, including nested stages.
+    profile = getattr(_profile_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    frames = getattr(_profile_local, 'frames', None)
+    if frames is None:
+        frames = _profile_local.frames = []
+    frame = None
+    if profiling['memory'] and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        for outer in frames:
+            outer['peak'] = max(outer['peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'start': current, 'peak': current}
+        frames.append(frame)
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        record = profile.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0, 'peak_bytes': 0})
+        record['wall_seconds'] += time.perf_counter() - wall_start
+        record['cpu_seconds'] += time.thread_time() - cpu_start
+        record['calls'] += 1
+        if frame is not None:
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            frames.pop()
+            for outer in frames:
+                outer['peak'] = max(outer['peak'], peak)
+            record['peak_bytes'] = max(record['peak_bytes'], peak - frame['start'])
+
+
+def merge_profiles(total, profile):
+    # Add the stage records of one profile to another: times and calls are
+    # summed, peak memory takes the maximum.
+    for name, record in profile.items():
+        into = total.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0, 'peak_bytes': 0})
+        into['wall_seconds'] += record['wall_seconds']
+        into['cpu_seconds'] += record['cpu_seconds']
+        into['calls'] += record['calls']
+        into['peak_bytes'] = max(into['peak_bytes'], record['peak_bytes'])
+    return total
+
+
+# Per-file details besides the redaction counts, such as the stage profile and
+# the paragraph cache hits and misses, gathered while a file is redacted.
+_details_local = threading.local()
+
+
+@contextlib.contextmanager
+def collect_details(details=None):
+    # Gather the details recorded on this thread into a dict (a new one unless
+    # one is passed in); with profiling on, the stage profile is its 'profile'.
+    details = {} if details is None else details
+    previous = getattr(_details_local, 'details', None)
+    _details_local.details = details
+    try:
+        if profiling['enabled']:
+            with collect_profile(details.setdefault('profile', {})):
+                yield details
+        else:
+            yield details
+    finally:
+        _details_local.details = previous
+
+
+def count_detail(name, key, amount=1):
+    # Add to a counter of the details being collected on this thread, if any.
+    details = getattr(_details_local, 'details', None)
+    if details is not None:
+        counter = details.setdefault(name, {})
+        counter[key] = counter.get(key, 0) + amount
+
+
+def append_detail(name, value):
+    # Add to a list of the details being collected on this thread, if any.
+    details = getattr(_details_local, 'details', None)
+    if details is not None:
+        details.setdefault(name, []).append(value)
+
+
+def peak_rss_bytes():
+    # Peak resident set size of this process and its finished children, or None where unavailable.
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
 def get_input_files(input_patterns):
     files = []
     for pattern in input_patterns:
@@ -28,24 +310,275 @@ def get_input_files(input_patterns):
     return files
 
 
-
-def verify_person_name_via_gnlp(name):
-    # Verify if the provided name is recognized as a PERSON entity using Google NLP.
-    client = language_v1.LanguageServiceClient()
+def parse_shard(value):
+    # Parse a --shard value "i/N" into (i, N), with shards numbered from 0.
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected i/N, got {value!r}')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'shard index must be between 0 and N-1, got {value!r}')
+    return index, count
+
+
+def shard_of(file_path, count):
+    # Shard a file belongs to. It depends only on the path as matched by the
+    # input patterns, so hosts that expand the same patterns in the same
+    # directory agree on it without coordinating.
+    key = os.path.normpath(file_path).replace(os.sep, '/')
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big') % count
+
+
+def select_shard(input_files, shard):
+    # Keep the input files of one (index, count) shard.
+    index, count = shard
+    return [file_path for file_path in input_files if shard_of(file_path, count) == index]
+
+
+
+_language_client = None
+_language_client_pid = None
+
+
+def get_language_client():
+    # Return a Google NLP client shared by every request in this process. gRPC
+    # channels do not survive a fork, so worker processes build their own.
+    global _language_client, _language_client_pid
+    if _language_client is None or _language_client_pid != os.getpid():
+        from google.cloud import language_v1
+        _language_client = language_v1.LanguageServiceClient()
+        _language_client_pid = os.getpid()
+    return _language_client
+
+
+class GNLPCache:
+    # On-disk cache of Google NLP results in SQLite, keyed by a hash of the
+    # request type and the text sent. Entries older than ttl seconds are treated
+    # as missing, and the least recently used entries are evicted once the cache
+    # holds more than max_entries results.
+
+    def __init__(self, path, max_entries=100000, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def connection(self):
+        # SQLite connections must not be shared across threads or a fork, so
+        # each thread of each process opens its own.
+        local = self._local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created_at REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+            connection.commit()
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    @staticmethod
+    def key(request_type, text):
+        return hashlib.sha256(f'{request_type}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, request_type, text):
+        # Return the cached result, or None when it is missing or expired.
+        key = self.key(request_type, text)
+        connection = self.connection()
+        row = connection.execute('SELECT value, created_at FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        now = time.time()
+        if self.ttl is not None and now - created_at > self.ttl:
+            connection.execute('DELETE FROM results WHERE key = ?', (key,))
+            connection.commit()
+            return None
+        connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (now, key))
+        connection.commit()
+        return json.loads(value)
+
+    def put(self, request_type, text, value):
+        now = time.time()
+        connection = self.connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO results (key, value, created_at, last_used) VALUES (?, ?, ?, ?)',
+            (self.key(request_type, text), json.dumps(value), now, now),
+        )
+        (size,) = connection.execute('SELECT COUNT(*) FROM results').fetchone()
+        if size > self.max_entries:
+            connection.execute(
+                'DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)',
+                (size - self.max_entries,),
+            )
+        connection.commit()
+
+
+gnlp_cache = None
+
+
+def configure_gnlp_cache(path, max_entries=100000, ttl=None):
+    # Enable the on-disk Google NLP result cache, or disable it when path is None.
+    global gnlp_cache
+    gnlp_cache = GNLPCache(path, max_entries=max_entries, ttl=ttl) if path else None
+
+
+# Settings for sending entity requests; see configure_gnlp.
+gnlp_settings = {
+    'backend': 'google',
+    'concurrency': 8,
+    'qps': None,
+    'retries': 3,
+    'backoff': 0.5,
+    'timeout': 30.0,
+    'latency': 0.0,
+}
+
+
+class RateLimiter:
+    # Spaces calls at least 1/qps seconds apart across all threads of a process.
+
+    def __init__(self, qps=None):
+        self.interval = 1.0 / qps if qps else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+gnlp_rate_limiter = RateLimiter()
+
+
+def configure_gnlp(**settings):
+    # Update the entity backend and request settings (backend, concurrency, qps,
+    # retries, backoff, timeout, latency).
+    global gnlp_rate_limiter
+    unknown = set(settings) - set(gnlp_settings)
+    if unknown:
+        raise ValueError(f'Unknown Google NLP settings: {", ".join(sorted(unknown))}')
+    if settings.get('backend', gnlp_settings['backend']) not in ENTITY_BACKENDS:
+        raise ValueError(f'Unknown entity backend: {settings["backend"]}')
+    gnlp_settings.update(settings)
+    gnlp_rate_limiter = RateLimiter(gnlp_settings['qps'])
+
+
+def google_analyze_entities(text, timeout=None):
+    # Entities found by the Google NLP service, as (name, type name) pairs.
+    from google.cloud import language_v1
     document = language_v1.Document(
-        content=name,
+        content=text,
         type_=language_v1.Document.Type.PLAIN_TEXT,
         language="en"  # Specify the language as English
     )
-    response = client.analyze_entities(document=document)
-    return any(entity.type == language_v1.Entity.Type.PERSON for entity in response.entities)
+    response = get_language_client().analyze_entities(document=document, timeout=timeout)
+    return [(entity.name, language_v1.Entity.Type(entity.type_).name) for entity in response.entities]
+
+
+def local_analyze_entities(text, timeout=None):
+    # Offline stand-in for the Google NLP service, for tests and benchmarks. It
+    # reports street addresses matched by address_patterns as ADDRESS entities and
+    # runs of capitalized words as PERSON entities, after the configured latency.
+    if gnlp_settings['latency']:
+        time.sleep(gnlp_settings['latency'])
+    entities = []
+    for pattern in address_patterns:
+        entities.extend((match.group(), 'ADDRESS') for match in pattern.finditer(text))
+    for match in re.finditer(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]*\.?)*\s+[A-Z][a-z]+\b', text):
+        entities.append((match.group(), 'PERSON'))
+    return entities
+
+
+ENTITY_BACKENDS = {
+    'google': google_analyze_entities,
+    'local': local_analyze_entities,
+}
+
+
+def is_retryable_gnlp_error(error):
+    # Throttling, timeouts and transient server errors are worth another attempt.
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        from google.api_core import exceptions as api_exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (
+        api_exceptions.TooManyRequests,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.InternalServerError,
+    ))
+
+
+def analyze_entities(text):
+    # Send one entity request to the configured backend, honouring the QPS limit
+    # and timeout and retrying transient failures with exponential backoff.
+    backend = ENTITY_BACKENDS[gnlp_settings['backend']]
+    retries = gnlp_settings['retries']
+    for attempt in range(retries + 1):
+        gnlp_rate_limiter.wait()
+        try:
+            with profile_stage('gnlp_request'):
+                return backend(text, timeout=gnlp_settings['timeout'])
+        except Exception as e:
+            if attempt == retries or not is_retryable_gnlp_error(e):
+                raise
+            time.sleep(gnlp_settings['backoff'] * 2 ** attempt)
+
+
+def cached_gnlp_request(request_type, text, request):
+    # Return the cached result of an entity request, sending it only on a cache
+    # miss. Results are cached per backend.
+    request_type = f"{gnlp_settings['backend']}/{request_type}"
+    if gnlp_cache is not None:
+        result = gnlp_cache.get(request_type, text)
+        if result is not None:
+            return result
+    result = request(text)
+    if gnlp_cache is not None:
+        gnlp_cache.put(request_type, text, result)
+    return result
+
+
+def request_person_verification(name):
+    return any(entity_type == 'PERSON' for _, entity_type in analyze_entities(name))
+
+
+def verify_person_name_via_gnlp(name):
+    # Verify if the provided name is recognized as a PERSON entity using Google NLP.
+    # Verdicts are remembered for the rest of the run.
+    return memoized_person_verdict(gnlp_settings['backend'], name)
+
+
+@functools.lru_cache(maxsize=100000)
+def memoized_person_verdict(backend, name):
+    return cached_gnlp_request('person', name, request_person_verification)
+
+
 
+name_with_email_regex = re.compile(r'\"?(.+?)\"?\s*<(.+)>')
 
 
+@functools.lru_cache(maxsize=100000)
 def process_name_comma_format(name):
     # Format names that might be in 'Lastname, Firstname' format or email format.
-    email_pattern = re.compile(r'\"?(.+?)\"?\s*<(.+)>')
-    match = email_pattern.match(name)
+    # The same people appear throughout a corpus, so results are memoized.
+    match = name_with_email_regex.match(name)
     
     if match:
         name_segment, email_segment = match.groups()
@@ -73,79 +606,234 @@ def sanitize_name(name):
 
 
 
+# Name detection settings: 'verify' checks every name found by spaCy with
+# verify_person_name_via_gnlp and drops the ones Google NLP does not see as a person.
+name_settings = {
+    'verify': False,
+}
+
+
+def configure_names(verify=None):
+    # Choose whether names found by spaCy are verified with Google NLP.
+    if verify is not None:
+        name_settings['verify'] = verify
+
+
 def extract_and_validate_names(doc):
     # Extract names using SpaCy and optionally verify them with Google NLP.
     validated_names = []
     for ent in doc.ents:
         if ent.label_ in ["PERSON"] :
             formatted_name = process_name_comma_format(ent.text)
+            if formatted_name and name_settings['verify'] and not verify_person_name_via_gnlp(formatted_name):
+                continue
             if formatted_name:  # Ensure the cleaned name is not empty
                 validated_names.append((formatted_name, ent.start_char, ent.end_char))
     return validated_names
 
 
+class NameGazetteer:
+    # Run-wide index of the person names confirmed so far. Later occurrences of
+    # a known name are found by exact matching with a trie-shaped regex (see
+    # trie_regex). Newly added names go to a small pending regex first and are
+    # folded into the main one in bulk, so the gazetteer is not recompiled for
+    # every new name.
+
+    def __init__(self):
+        self.names = set()
+        self.pending = set()
+        self.regex = None
+        self.pending_regex = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def compile(names):
+        if not names:
+            return None
+        first_chars = re.escape(''.join(sorted({name[0] for name in names})))
+        return re.compile(rf'(?<!\w)(?=[{first_chars}])(?:{trie_regex(names)})(?!\w)')
+
+    def learn(self, name):
+        # Add a name as it appears in the text, and in 'Firstname Lastname' order
+        # when it was written 'Lastname, Firstname'. Only names of two or more
+        # words are added, unless names are verified.
+        surface = sanitize_name(name)
+        forms = {surface, process_name_comma_format(surface)}
+        with self.lock:
+            for form in forms:
+                if form and '<' not in form and (name_settings['verify'] or ' ' in form) \
+                        and form not in self.names and form not in self.pending:
+                    self.pending.add(form)
+                    self.pending_regex = None
+                    # Reported with the file, so a manifest can keep it for later runs
+                    append_detail('learned_names', form)
+
+    def load(self, names):
+        # Add names learned by an earlier run.
+        with self.lock:
+            self.names.update(names)
+            self.names -= self.pending
+            self.names |= self.pending
+            self.pending = set()
+            self.regex = self.compile(self.names)
+            self.pending_regex = None
+
+    def find_spans(self, text):
+        # Find every occurrence of a known name.
+        with self.lock:
+            if len(self.pending) >= max(64, len(self.names) // 8):
+                self.names |= self.pending
+                self.pending = set()
+                self.regex = self.compile(self.names)
+                self.pending_regex = None
+            if self.pending_regex is None:
+                self.pending_regex = self.compile(self.pending)
+            regexes = [regex for regex in (self.regex, self.pending_regex) if regex is not None]
+        spans = []
+        for regex in regexes:
+            found = [Span(match.start(), match.end(), 'name', 'name_gazetteer') for match in regex.finditer(text)]
+            spans.extend(drop_overlapping_spans(found, spans) if spans else found)
+        return spans
+
+
+# Set by configure_name_gazetteer; None disables the gazetteer.
+name_gazetteer = None
+
+
+def configure_name_gazetteer(enabled):
+    # Start a new, empty name gazetteer, or disable it.
+    global name_gazetteer
+    name_gazetteer = NameGazetteer() if enabled else None
+
+
+MASK_CHAR = '█'
+
+# A region of text to censor, tagged with the kind of entity it covers and the
+# detector that found it.
+Span = namedtuple('Span', ['start', 'end', 'type', 'detector'], defaults=(None,))
+
+# Maps span types to the keys used in the statistics output.
+SPAN_TYPE_STATS = {
+    'name': 'names',
+    'date': 'dates',
+    'phone': 'phones',
+    'address': 'addresses',
+    'concept': 'concepts',
+}
+
+
+def clip_at_newline(text, start_pos, end_pos):
+    # Stop a span at the first newline it contains so masks never cross line breaks.
+    newline_idx = text.find('\n', start_pos, end_pos)
+    if newline_idx != -1:
+        end_pos = newline_idx
+    return start_pos, end_pos
+
+
+def span_order(span):
+    # Sort key for spans: by position only, as types and detectors may be None.
+    return span.start, span.end
+
+
+def merge_spans(spans):
+    # Sort spans and merge the ones that overlap or touch. Each merged span keeps
+    # the type of the span that starts it.
+    merged = []
+    for span in sorted(spans, key=span_order):
+        if span.end <= span.start:
+            continue
+        if merged and span.start <= merged[-1].end:
+            last = merged[-1]
+            if span.end > last.end:
+                merged[-1] = last._replace(end=span.end)
+        else:
+            merged.append(span)
+    return merged
+
+
+# How a censored span is written out. "block" and "x" keep the text length;
+# "type" replaces the span with a tag naming its type, such as [NAME].
+MASK_STYLES = ('block', 'x', 'type')
+
+mask_settings = {
+    'style': 'block',
+}
+
+
+def configure_mask_style(style=None):
+    # Choose how redact_text writes censored spans.
+    if style is not None:
+        if style not in MASK_STYLES:
+            raise ValueError(f'Unknown mask style: {style}')
+        mask_settings['style'] = style
+
+
+def span_mask(span, style='block'):
+    # Replacement text for one censored span.
+    if style == 'type':
+        return f'[{(span.type or "redacted").upper()}]'
+    return (MASK_CHAR if style == 'block' else 'X') * (span.end - span.start)
+
+
+def render_masked_text(text, spans, style='block'):
+    # Write the text with every span censored, in a single linear pass. Views
+    # scanned by the detectors always use the length-preserving block style.
+    output = io.StringIO()
+    position = 0
+    for span in merge_spans(spans):
+        output.write(text[position:span.start])
+        output.write(span_mask(span, style))
+        position = span.end
+    output.write(text[position:])
+    return output.getvalue()
+
+
+def count_spans(spans):
+    # Count spans per statistics key.
+    counts = dict.fromkeys(SPAN_TYPE_STATS.values(), 0)
+    for span in spans:
+        counts[SPAN_TYPE_STATS[span.type]] += 1
+    return counts
+
+
+def find_email_name_spans(text):
+    # Mask the local part of every email address, keeping the domain readable
+    return scan_pattern_spans(text, emails=True)
+
+
 def mask_names_in_email_addresses(text):
-    # Regular expression to find email addresses
-    email_regex = r'[\w\.-]+@[\w\.-]+'
-    masked_text = text
-    total_names_masked = 0
-    offset = 0  # To adjust positions after masking
-
-    # Find all email addresses in the text
-    matches = list(re.finditer(email_regex, text))
-    for match in matches:
-        email = match.group()
-        start_pos = match.start() + offset
-        end_pos = match.end() + offset
-
-        # Split the email into local part and domain
-        local_part, domain = email.split('@', 1)
-        # Mask the local part
-        masked_local = '█' * len(local_part)
-        masked_email = masked_local + '@' + domain
-
-        # Replace the email in the text with the masked email
-        masked_text = masked_text[:start_pos] + masked_email + masked_text[end_pos:]
-        # Update the offset
-        offset += len(masked_email) - (end_pos - start_pos)
-        total_names_masked += 1
-
-    return masked_text, total_names_masked
-
-def mask_names_in_text(text):
-    # Redact names found in the text using SpaCy
-    doc = nlp(text)
-    validated_names = extract_and_validate_names(doc)
-    masked_text = text
-    total_names_masked = 0
-    masked_positions = []
-
-    # First, mask names extracted from regular text using SpaCy.
-    # Sort names by start position in reverse order to avoid index shifting
-    validated_names = sorted(validated_names, key=lambda x: x[1], reverse=True)
-    for name, start_pos, end_pos in validated_names:
-        masked_text = apply_mask(masked_text, start_pos, end_pos)
-        total_names_masked += 1
-        masked_positions.append({'type': 'name', 'start': start_pos, 'end': end_pos})
-    
-    # Then, mask names found within email addresses.
-    masked_text, email_name_count = mask_names_in_email_addresses(masked_text)
-    total_names_masked += email_name_count
+    spans = find_email_name_spans(text)
+    return render_masked_text(text, spans), len(spans)
+
 
-    return masked_text, total_names_masked
+def find_entity_name_spans(text, doc=None):
+    # Find names in the text using SpaCy. A Doc parsed from the same text can be
+    # passed in to avoid running the pipeline again.
+    if doc is None:
+        doc = get_nlp()(text)
+    spans = []
+    for name, start_pos, end_pos in extract_and_validate_names(doc):
+        start_pos, end_pos = clip_at_newline(text, start_pos, end_pos)
+        spans.append(Span(start_pos, end_pos, 'name', 'spacy_ner'))
+    return spans
+
+
+def find_name_spans(text, doc=None):
+    # Find names in the text using SpaCy, plus names within email addresses.
+    return find_entity_name_spans(text, doc=doc) + find_email_name_spans(text)
+
+
+def mask_names_in_text(text, doc=None):
+    # Redact names found in the text using SpaCy
+    spans = find_name_spans(text, doc=doc)
+    return render_masked_text(text, spans), len(spans)
 
 
 
 def apply_mask(text, start_pos, end_pos):
     # Apply a censorship mask to a specified portion of text, adjusting for new lines.
-    segment = text[start_pos:end_pos]
-    newline_idx = segment.find('\n')
-    
-    # Adjust end position if a newline character is found within the segment
-    if newline_idx != -1:
-        end_pos = start_pos + newline_idx
-    
-    return text[:start_pos] + "█" * (end_pos - start_pos) + text[end_pos:]
+    start_pos, end_pos = clip_at_newline(text, start_pos, end_pos)
+    return render_masked_text(text, [Span(start_pos, end_pos, None)])
 
 dict_for_date_match = [
     {
@@ -159,66 +847,226 @@ dict_for_date_match = [
     }
 ]
 
-ruler = nlp.add_pipe("entity_ruler", before="ner")
-ruler.add_patterns(dict_for_date_match)
+def trie_regex(words):
+    # Build a regex matching any of the words, shaped as a trie so words sharing
+    # a prefix share their alternatives and a match never backtracks across
+    # words. Longer words are preferred over their prefixes.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            pattern = f'(?:{pattern})?' if len(branches) == 1 else pattern + '?'
+        return pattern
+
+    return build(trie)
+
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+MONTH_WORDS = MONTH_NAMES + [month[:3] for month in MONTH_NAMES] + ['Sept']
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+WEEKDAY_WORDS = WEEKDAY_NAMES + [day[:3] for day in WEEKDAY_NAMES] + ['Tues', 'Thur', 'Thurs']
+
+MONTH_PATTERN = trie_regex(MONTH_WORDS + [month.upper() for month in MONTH_WORDS])
+WEEKDAY_PATTERN = trie_regex(WEEKDAY_WORDS + [day.upper() for day in WEEKDAY_WORDS])
+DAY_PATTERN = r'\d{1,2}(?:st|nd|rd|th)?(?!\d)'
+
+# Whole-text date formats for the rule-based date engine, in priority order.
+DATE_PATTERNS = (
+    ('header', rf'(?:{WEEKDAY_PATTERN}),?\s+\d{{1,2}}\s+(?:{MONTH_PATTERN})\.?\s+\d{{4}}'),                 # Mon, 14 May 2001
+    ('month_day', rf'(?:(?:{WEEKDAY_PATTERN}),?\s+)?(?:{MONTH_PATTERN})\.?\s+{DAY_PATTERN}(?:,?\s+\d{{4}})?'),  # Jan 1, 2024 or Monday, January 1st
+    ('month_year', rf'(?:{MONTH_PATTERN})\.?,?\s+\d{{4}}'),                                                    # January 2024
+    ('day_month', rf'{DAY_PATTERN}\s+(?:{MONTH_PATTERN})\.?(?:,?\s+\d{{4}})?'),                                 # 1 Jan 2024
+    ('iso', r'\d{4}-\d{1,2}-\d{1,2}'),                                                                       # 2024-01-01
+    ('numeric', r'\d{1,2}[/-]\d{1,2}[/-](?:\d{4}|\d{2})'),                                                   # MM/DD/YYYY or similar
+    ('numeric_day', r'\d{1,2}[/-]\d{1,2}'),                                                                   # MM/DD
+    ('weekday', trie_regex(WEEKDAY_NAMES)),                                                                   # Monday
+)
+
+# Date kinds that are often something else (fractions, ranges, scores), which
+# the NER can confirm when date_settings['confirm'] is on.
+AMBIGUOUS_DATE_KINDS = {'numeric_day'}
+
+date_regex = re.compile(
+    r'(?<![\w/-])(?=[\d' + ''.join(sorted({word[0] for word in MONTH_WORDS + WEEKDAY_WORDS})) + r'])(?:'
+    + '|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in DATE_PATTERNS)
+    + r')(?![\w/-])'
+)
+
+# Date detection settings: 'engine' is 'ner' (DATE entities of the spaCy
+# pipeline), 'rules' (date_regex) or 'auto', which uses the rules unless the
+# document is parsed for names or concepts anyway.
+date_settings = {
+    'engine': 'auto',
+    'confirm': False,
+}
+
+
+def configure_dates(engine=None, confirm=None):
+    # Choose the date engine and whether ambiguous rule-based dates are confirmed by the NER.
+    if engine is not None:
+        if engine not in ('auto', 'ner', 'rules'):
+            raise ValueError(f'Unknown date engine: {engine}')
+        date_settings['engine'] = engine
+    if confirm is not None:
+        date_settings['confirm'] = confirm
+
+
+def date_engine(names=False, concepts=None):
+    # The date engine used when the given redactors are enabled alongside dates.
+    engine = date_settings['engine']
+    if engine == 'auto':
+        return 'ner' if names or concepts else 'rules'
+    return engine
+
+
+def needs_date_ner(names=False, dates=False, concepts=None, **options):
+    # Whether date detection reads entities from the NER.
+    return bool(dates) and (date_engine(names=names, concepts=concepts) == 'ner' or date_settings['confirm'])
+
+
+def is_valid_numeric_date(match):
+    # Reject numeric dates whose parts cannot be a month and a day in either order.
+    parts = [int(part) for part in re.split(r'[/-]', match.group())]
+    if match.lastgroup == 'iso':
+        return 1 <= parts[1] <= 12 and 1 <= parts[2] <= 31
+    first, second = parts[0], parts[1]
+    return 1 <= first <= 31 and 1 <= second <= 31 and (first <= 12 or second <= 12)
+
+
+def find_rule_date_spans(text, doc=None):
+    # Find dates with date_regex in one pass over the text. With confirmation on,
+    # ambiguous dates are kept only where the NER also sees a date, reading the
+    # entities of doc when given and otherwise parsing just their lines.
+    spans = []
+    ambiguous = []
+    for match in date_regex.finditer(text):
+        kind = match.lastgroup
+        if kind in ('iso', 'numeric', 'numeric_day') and not is_valid_numeric_date(match):
+            continue
+        span = Span(match.start(), match.end(), 'date', 'date_rules')
+        if kind in AMBIGUOUS_DATE_KINDS and date_settings['confirm']:
+            ambiguous.append(span)
+        else:
+            spans.append(span)
+    if ambiguous:
+        spans.extend(confirm_dates(text, ambiguous, doc=doc))
+        spans.sort(key=span_order)
+    return spans
 
-def redact_dates(text):
-    redacted_text = text
-    count = 0
-    offsets = [] 
-    doc = nlp(text)
-    spans = [ent for ent in doc.ents if ent.label_ == 'DATE']
-    unique_spans = set()
+
+def confirm_dates(text, spans, doc=None):
+    # Keep the spans that overlap a DATE entity of the NER.
+    if doc is not None:
+        entities = [(ent.start_char, ent.end_char) for ent in doc.ents if ent.label_ == 'DATE']
+        return [span for span in spans if any(start < span.end and span.start < end for start, end in entities)]
+
+    lines = {}
     for span in spans:
-        if isinstance(span, dict):
-            unique_spans.add((span['start_char'], span['end_char']))
-        else:
-            unique_spans.add((span.start_char, span.end_char))
-    
-    spans = sorted(unique_spans, key=lambda x: x[0], reverse=True)
-    
-    for start, end in spans:
-        redacted_text = redacted_text[:start] + '█' * (end - start) + redacted_text[end:]
-        count += 1
-        offsets.append({'type': 'date', 'start': start, 'end': end})
-    
-    return redacted_text, count
+        line_start = text.rfind('\n', 0, span.start) + 1
+        line_end = text.find('\n', span.end)
+        lines.setdefault((line_start, len(text) if line_end == -1 else line_end), []).append(span)
+    confirmed = []
+    line_texts = [text[start:end] for start, end in lines]
+    for ((line_start, _), line_spans), line_doc in zip(lines.items(), get_nlp().pipe(line_texts)):
+        for span in line_spans:
+            start, end = span.start - line_start, span.end - line_start
+            if any(ent.label_ == 'DATE' and ent.start_char < end and start < ent.end_char for ent in line_doc.ents):
+                confirmed.append(span)
+    return confirmed
+
+
+def find_ner_date_spans(text, doc=None):
+    # Find the DATE entities of the spaCy pipeline.
+    if doc is None:
+        doc = get_nlp()(text)
+    unique_spans = set()
+    for ent in doc.ents:
+        if ent.label_ == 'DATE':
+            unique_spans.add((ent.start_char, ent.end_char))
+    return [Span(start, end, 'date', 'spacy_ner') for start, end in sorted(unique_spans)]
+
+
+def find_date_spans(text, doc=None, engine=None):
+    # Find dates with the given engine ('ner' or 'rules'), by default the one
+    # date_engine() picks when dates are the only redactor reading the NER.
+    if engine is None:
+        engine = date_engine()
+    if engine == 'rules':
+        return find_rule_date_spans(text, doc=doc)
+    return find_ner_date_spans(text, doc=doc)
+
+
+def redact_dates(text, doc=None):
+    spans = find_date_spans(text, doc=doc)
+    return render_masked_text(text, spans), len(spans)
 
 
-# Regex pattern for phone numbers
-phone_number_regex = re.compile(
-    r'''
+# Regex pattern for phone numbers. A match never starts inside a longer run of
+# digits, so long digit runs are tried once instead of at every position.
+PHONE_PATTERN = r'''
+    (?<!\d)
     (\+\d{1,3}[\s-]?)?                      # Optional international prefix
     (\(?\d{3}\)?[\s-]?)?                    # Optional area code
     (\d{3}[\s-]?\d{4}|\d{2,4}[\s-]?\d{2,4}[\s-]?\d{2,4}) # Main number
-    ''', re.VERBOSE | re.IGNORECASE)
+    '''
+phone_number_regex = re.compile(PHONE_PATTERN, re.VERBOSE)
 
 def validate_phone_number_format(text):
     # Check if a given string is likely a phone number.
     return re.match(r'\+\d{1,4}\s\d+', text) or any(sep in text for sep in ['-', ' ']) and len(re.sub(r'\D', '', text)) >= 7
 
 
-def detect_concept_related_sentences(text, concepts, threshold=0.75):
-    # Normalize text to handle line breaks
-    text = normalize_text(text)
-    doc = nlp(text)
+@functools.lru_cache(maxsize=None)
+def get_concept_vectors(concepts):
+    # Embed each concept once per run. Takes a tuple so the result can be cached.
+    import numpy
+    nlp = get_nlp()
+    return numpy.array([nlp(concept).vector for concept in concepts], dtype='float32')
+
+
+def cosine_similarity_matrix(rows, columns):
+    # Cosine similarity of every row vector against every column vector. Pairs
+    # involving a zero vector score 0, as Span.similarity does.
+    import numpy
+    row_norms = numpy.linalg.norm(rows, axis=1)
+    column_norms = numpy.linalg.norm(columns, axis=1)
+    norms = numpy.outer(row_norms, column_norms)
+    products = rows @ columns.T
+    return numpy.divide(products, norms, out=numpy.zeros_like(products), where=norms != 0)
+
+
+def detect_concept_related_sentences(text, concepts, threshold=0.75, doc=None):
+    if doc is None:
+        # Normalize text to handle line breaks
+        text = normalize_text(text)
+        doc = get_nlp()(text)
+    sentences = list(doc.sents)
+    if not sentences or not concepts:
+        return []
+    import numpy
+
+    # Score all sentences against all concepts in one matrix operation
+    sentence_vectors = numpy.array([sentence.vector for sentence in sentences], dtype='float32')
+    similarities = cosine_similarity_matrix(sentence_vectors, get_concept_vectors(tuple(concepts)))
+    similar_sentences = (similarities >= threshold).any(axis=1)
+
+    concepts_lower = [concept.lower() for concept in concepts]
     matched_concepts = []
-
-    for sentence in doc.sents:
+    for sentence, is_similar in zip(sentences, similar_sentences):
         sentence_text_lower = sentence.text.lower()
-        for concept in concepts:
-            concept_lower = concept.lower()
-            # Direct string matching
-            if concept_lower in sentence_text_lower:
-                matched_concepts.append((sentence.start_char, sentence.end_char))
-                break  # Stop checking other concepts if this sentence matches
-            else:
-                # Calculate similarity between the sentence and the concept
-                concept_doc = nlp(concept)
-                similarity = sentence.similarity(concept_doc)
-                if similarity >= threshold:
-                    matched_concepts.append((sentence.start_char, sentence.end_char))
-                    break
+        # Direct string matching, otherwise the similarity to any concept
+        if is_similar or any(concept_lower in sentence_text_lower for concept_lower in concepts_lower):
+            matched_concepts.append((sentence.start_char, sentence.end_char))
 
     return matched_concepts
 
@@ -228,84 +1076,187 @@ def normalize_text(text):
     normalized_text = re.sub(r'(?<!\n)\n(?!\n)', ' ', text)
     return normalized_text
 
-def mask_concept_related_text(text, concepts):
+def find_concept_spans(text, concepts, doc=None):
+    # Find sentences related to the specified concepts.
+    spans = []
+    for start_char, end_char in detect_concept_related_sentences(text, concepts, doc=doc):
+        start_char, end_char = clip_at_newline(text, start_char, end_char)
+        spans.append(Span(start_char, end_char, 'concept', 'concept_similarity'))
+    return spans
+
+
+def mask_concept_related_text(text, concepts, doc=None):
     # Redact text related to specified concepts.
-    matched_concepts = detect_concept_related_sentences(text, concepts)
-    masked_text = text
-    concept_count = 0
-    masked_positions = []
-
-    # Sort matched spans in reverse order to avoid index shifting issues.
-    matched_concepts = sorted(matched_concepts, key=lambda x: x[0], reverse=True)
-    for start_char, end_char in matched_concepts:
-        masked_text = apply_mask(masked_text, start_char, end_char)
-        concept_count += 1
-        masked_positions.append({'type': 'concept', 'start': start_char, 'end': end_char})
-    
-    return masked_text, concept_count
+    spans = find_concept_spans(text, concepts, doc=doc)
+    return render_masked_text(text, spans), len(spans)
+
+
+def find_phone_spans(text):
+    # Identify phone numbers in the given text.
+    return scan_pattern_spans(text, phones=True)
 
 
 def mask_phone_numbers_in_text(text):
     # Identify and mask phone numbers in the given text.
-    phone_matches = re.finditer(phone_number_regex, text)
-    masked_text = text
-    total_phones_masked = 0
-    masked_positions = []
-
-    for match in phone_matches:
-        matched_string = match.group().strip()
-        if validate_phone_number_format(matched_string):
-            start, end = match.span()
-            masked_text = apply_mask(masked_text, start, end)
-            total_phones_masked += 1
-            masked_positions.append({'type': 'phone', 'start': start, 'end': end})
-    
-    return masked_text, total_phones_masked
+    spans = find_phone_spans(text)
+    return render_masked_text(text, spans), len(spans)
 
-def mask_detected_addresses(text):
-    # Redact detected addresses from the text using Google NLP and regex patterns.
-    masked_text = text
-    total_addresses_masked = 0
-
-    # Regex patterns for common address formats
-    address_patterns = [
-        r"\d{1,5}\s\w+\s(?:St|Street|Ave|Avenue|Rd|Road|Blvd|Boulevard|Dr|Drive|Ln|Lane)\.?(\s\w+)?",   # E.g., 123 Main St or 123 Main Street Springfield
-        r"\d{1,5}\s\w+\s\w+\s\w+,\s\w+\s\d{5}",                                                          # E.g., 456 Elm St., New York, NY 10001
-        r"\d{1,5}\s\w+\s\w+,\s\w+,\s[A-Z]{2}\s\d{5}",                                                    # E.g., 123 Main St., Springfield, IL 62704
-    ]
 
-    # Mask detected addresses with Google NLP, consolidating related address components
+# Regex patterns for common address formats
+ADDRESS_PATTERNS = [
+    r"\d{1,5}\s\w+\s(?:St|Street|Ave|Avenue|Rd|Road|Blvd|Boulevard|Dr|Drive|Ln|Lane)\.?(\s\w+(?![\w.-]*@))?",  # E.g., 123 Main St or 123 Main Street Springfield
+    r"\d{1,5}\s\w+\s\w+\s\w+,\s\w+\s\d{5}",                                                                   # E.g., 456 Elm St., New York, NY 10001
+    r"\d{1,5}\s\w+\s\w+,\s\w+,\s[A-Z]{2}\s\d{5}",                                                             # E.g., 123 Main St., Springfield, IL 62704
+]
+address_patterns = [re.compile(pattern) for pattern in ADDRESS_PATTERNS]
+
+# Email addresses are found from their '@': the domain is matched forward and
+# the local part, which is what gets masked, is read backwards from it.
+EMAIL_DOMAIN_PATTERN = r'@[\w.-]+'
+email_local_char_regex = re.compile(r'[\w.-]')
+
+# Alternatives of the pattern scanner with the characters their matches can
+# start with, in priority order.
+SCANNER_ALTERNATIVES = (
+    ('email', EMAIL_DOMAIN_PATTERN, '@'),
+    ('phone', PHONE_PATTERN, r'\d+('),
+    ('address', '|'.join(f'(?:{pattern})' for pattern in ADDRESS_PATTERNS), r'\d'),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pattern_scanner(kinds):
+    # Compile one regex matching every kind of pattern-based entity in kinds
+    # ('email', 'phone', 'address'), or None when kinds is empty. The leading
+    # lookahead lets the scan skip positions no alternative can start at.
+    enabled = [(kind, pattern, first) for kind, pattern, first in SCANNER_ALTERNATIVES if kind in kinds]
+    if not enabled:
+        return None
+    first_chars = ''.join(first for _, _, first in enabled)
+    alternatives = '|'.join(f'(?P<{kind}>{pattern})' for kind, pattern, _ in enabled)
+    return re.compile(f'(?=[{first_chars}])(?:{alternatives})', re.VERBOSE)
+
+
+def find_email_local_part(text, at_pos, limit):
+    # Return where the local part of the email address whose '@' is at at_pos
+    # starts, not looking further back than limit.
+    start = at_pos
+    while start > limit and email_local_char_regex.match(text, start - 1):
+        start -= 1
+    return start
+
+
+def scan_pattern_spans(text, emails=False, phones=False, addresses=False):
+    # Find email local parts (as names), phone numbers and street addresses in a
+    # single left-to-right pass. Matches never overlap and email addresses take
+    # priority, so each kind only sees the text the others left, as when each
+    # redactor masked the text in turn. A match that fails phone validation is
+    # retried as an address starting within it.
+    kinds = frozenset(kind for kind, enabled in (('email', emails), ('phone', phones), ('address', addresses)) if enabled)
+    scanner = get_pattern_scanner(kinds)
+    if scanner is None:
+        return []
+    fallback = get_pattern_scanner(kinds & {'address'})
+
+    spans = []
+    position = 0
+    email_end = 0
+    while True:
+        match = scanner.search(text, position)
+        if match is None:
+            return spans
+        position = match.end()
+        kind = match.lastgroup
+
+        if kind == 'email':
+            local_start = find_email_local_part(text, match.start(), email_end)
+            if local_start == match.start():
+                position = match.start() + 1
+                continue
+            # The local part wins over phone numbers or addresses matched inside it
+            while spans and spans[-1].type != 'name' and spans[-1].end > local_start:
+                spans.pop()
+            spans.append(Span(local_start, match.start(), 'name', 'email_pattern'))
+            email_end = match.end()
+            # Only the local part is taken; phone numbers and addresses are
+            # still looked for in the domain
+            position = match.start() + 1
+            continue
+
+        if kind == 'phone' and not validate_phone_number_format(match.group().strip()):
+            retry = None
+            if fallback is not None:
+                # Bounded by the phone match, so the scan stays linear
+                for start in range(match.start(), match.end()):
+                    retry = fallback.match(text, start)
+                    if retry is not None:
+                        break
+            if retry is None:
+                continue
+            match = retry
+            position = match.end()
+            kind = match.lastgroup
+
+        if kind == 'phone':
+            start, end = clip_at_newline(text, *match.span())
+            spans.append(Span(start, end, 'phone', 'phone_pattern'))
+        else:
+            spans.append(Span(match.start(), match.end(), 'address', 'address_pattern'))
+
+
+def find_gnlp_address_spans(text):
+    # Find the addresses detected by Google NLP, consolidating related address components.
+    spans = []
     detected_addresses = consolidate_addresses(extract_addresses_using_gnlp(text))
     for address in detected_addresses:
-        # Mask the full address in the text if found
-        address_pattern = re.escape(address)
-        masked_text = re.sub(address_pattern, '█' * len(address), masked_text)
-        total_addresses_masked += 1
+        for match in re.finditer(re.escape(address), text):
+            spans.append(Span(match.start(), match.end(), 'address', 'entity_service'))
+    return spans
 
-    # Additionally, mask common address formats using regex
-    for pattern in address_patterns:
-        matches = re.finditer(pattern, masked_text)
-        for match in matches:
-            start, end = match.span()
-            
-            masked_text = masked_text[:start] + '█' * (end - start) + masked_text[end:]
-            total_addresses_masked += 1
 
-    return masked_text, total_addresses_masked
+def drop_overlapping_spans(spans, existing):
+    # Keep the spans that do not overlap any of the existing ones.
+    existing = merge_spans(existing)
+    starts = [span.start for span in existing]
+    kept = []
+    for span in spans:
+        i = bisect.bisect_right(starts, span.start)
+        if i and existing[i - 1].end > span.start:
+            continue
+        if i < len(existing) and existing[i].start < span.end:
+            continue
+        kept.append(span)
+    return kept
+
+
+def find_address_spans(text, pattern_spans=None):
+    # Detect addresses in the text using Google NLP and regex patterns. Address
+    # matches of the pattern scanner can be passed in when the text was already
+    # scanned; matches overlapping an address found by Google NLP are dropped.
+    spans = find_gnlp_address_spans(text)
+    if pattern_spans is None:
+        pattern_spans = scan_pattern_spans(text, addresses=True)
+    spans.extend(drop_overlapping_spans(pattern_spans, spans))
+    return spans
 
-def extract_addresses_using_gnlp(text):
-    # Extract address components using Google NLP and return them as individual segments.
-    client = language_v1.LanguageServiceClient()
-    document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
-    response = client.analyze_entities(document=document)
 
+def mask_detected_addresses(text):
+    # Redact detected addresses from the text using Google NLP and regex patterns.
+    spans = find_address_spans(text)
+    return render_masked_text(text, spans), len(spans)
+
+def request_address_entities(text):
     # Extract entities that represent addresses or locations.
     detected_addresses = [
-        entity.name for entity in response.entities
-        if entity.type_ in [language_v1.Entity.Type.ADDRESS, language_v1.Entity.Type.LOCATION]
+        name for name, entity_type in analyze_entities(text)
+        if entity_type in ['ADDRESS', 'LOCATION']
     ]
     return detected_addresses
 
+def extract_addresses_using_gnlp(text):
+    # Extract address components using Google NLP and return them as individual segments.
+    return cached_gnlp_request('addresses', text, request_address_entities)
+
 def consolidate_addresses(components):
     # Consolidate individual address components into full address strings.
     consolidated_addresses = []
@@ -317,7 +1268,7 @@ def consolidate_addresses(components):
             # If the current component is not numeric and we have an ongoing address, finalize it
             consolidated_addresses.append(" ".join(current_address))
             current_address = []
-        
+
         current_address.append(component)
 
     # Add any remaining components as a final address
@@ -326,6 +1277,1639 @@ def consolidate_addresses(components):
 
     return consolidated_addresses
 
+# Email structure parsing (--email-headers). Header blocks, including the ones
+# quoted after "-----Original Message-----", are redacted by parsing their
+# fields, and only the rest of the message is passed to spaCy.
+email_settings = {
+    'headers': False,
+}
+
+# Header name classes, lower-cased and without the colon. Subjects are free
+# text and stay in the text spaCy reads; the X-Folder, X-Origin and X-FileName
+# values are mailbox identifiers derived from the owner's name.
+EMAIL_TEXT_HEADERS = {'subject'}
+EMAIL_IDENTIFIER_HEADERS = {'x-folder', 'x-origin', 'x-filename'}
+EMAIL_NAME_HEADERS = ({header[:-1].lower() for header in EMAIL_HEADERS} - EMAIL_TEXT_HEADERS - EMAIL_IDENTIFIER_HEADERS
+                      | {'reply-to', 'sender', 'x-sender', 'return-path', 'delivered-to'})
+EMAIL_DATE_HEADERS = {'date', 'sent'}
+# Headers that only hold message identifiers and encodings.
+EMAIL_TECHNICAL_HEADERS = {'message-id', 'in-reply-to', 'references', 'mime-version', 'content-type',
+                           'content-transfer-encoding'}
+# Headers whose values spaCy does not read: the ones redacted by
+# find_header_spans and the technical ones. spaCy reads the values of every
+# other header, such as the subject, like the body.
+EMAIL_HIDDEN_HEADERS = EMAIL_NAME_HEADERS | EMAIL_IDENTIFIER_HEADERS | EMAIL_DATE_HEADERS | EMAIL_TECHNICAL_HEADERS
+
+header_line_regex = re.compile(r'([A-Za-z][\w-]*):[ \t]*')
+original_message_regex = re.compile(r'[ \t>]*-{2,}\s*Original Message\s*-{2,}[ \t]*$', re.IGNORECASE)
+quote_marker_regex = re.compile(r'^[ \t]*>[ \t>]*', re.MULTILINE)
+paragraph_regex = re.compile(r'\S(?:.|\n(?![ \t]*\n))*')
+
+# A parsed header field: its lower-cased name and the character range of its value.
+HeaderField = namedtuple('HeaderField', ['name', 'start', 'end'])
+
+# The structure of an email document: its header fields, the ranges spaCy does
+# not need to read, and paragraphs repeating an earlier one as
+# (source_start, start, length).
+EmailLayout = namedtuple('EmailLayout', ['fields', 'hidden', 'repeats'])
+
+
+def configure_email_parsing(headers=None):
+    # Turn the header-aware email parsing on or off.
+    if headers is not None:
+        email_settings['headers'] = headers
+
+
+def iter_lines(text, start=0):
+    # Yield (line_start, line_end) for every line from start on, without the newline.
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            end = len(text)
+        yield start, end
+        start = end + 1
+
+
+def parse_header_block(text, start, fields):
+    # Parse the header lines from start up to the first blank line into fields.
+    # Returns the end of the block, or start when the first line is no header.
+    block_end = start
+    for line_start, line_end in iter_lines(text, start):
+        if line_start == line_end or text[line_start:line_end].isspace():
+            break
+        match = header_line_regex.match(text, line_start, line_end)
+        if match:
+            fields.append(HeaderField(match.group(1).lower(), match.end(), line_end))
+        elif fields and text[line_start] in ' \t' and block_end > start:
+            # Continuation of the previous field
+            fields[-1] = fields[-1]._replace(end=line_end)
+        else:
+            break
+        block_end = line_end
+    return block_end
+
+
+def parse_email_layout(text):
+    # Find the header blocks of an email document (the leading one and those of
+    # quoted "-----Original Message-----" replies), the quote markers of '>'
+    # quoted lines, and the paragraphs that repeat an earlier one, as quoted
+    # replies do.
+    fields = []
+    hidden = []
+    block_end = parse_header_block(text, 0, fields)
+    if not any(field.name in EMAIL_NAME_HEADERS or field.name in EMAIL_DATE_HEADERS for field in fields):
+        fields, block_end = [], 0
+
+    for line_start, line_end in iter_lines(text, block_end):
+        if original_message_regex.match(text, line_start, line_end):
+            quoted_fields = []
+            parse_header_block(text, line_end + 1, quoted_fields)
+            fields.extend(quoted_fields)
+            hidden.append((line_start, line_end))
+
+    # Header names are hidden, and so are the values of EMAIL_HIDDEN_HEADERS
+    for field in fields:
+        hidden.append((text.rfind('\n', 0, field.start) + 1, field.start))
+        if field.name in EMAIL_HIDDEN_HEADERS:
+            hidden.append((field.start, field.end))
+
+    hidden.extend(match.span() for match in quote_marker_regex.finditer(text))
+    hidden = merge_spans(Span(start, end, None) for start, end in hidden)
+
+    # Paragraphs repeated from earlier in the document are not parsed again
+    repeats = []
+    seen = {}
+    view = blank_ranges(text, hidden)
+    for match in paragraph_regex.finditer(view):
+        paragraph = match.group().rstrip()
+        if paragraph in seen:
+            repeats.append((seen[paragraph], match.start(), len(paragraph)))
+            hidden.append(Span(match.start(), match.start() + len(paragraph), None))
+        else:
+            seen[paragraph] = match.start()
+    return EmailLayout(fields, merge_spans(hidden), repeats)
+
+
+def blank_ranges(text, ranges):
+    # Replace everything but newlines in the given sorted, disjoint ranges with
+    # spaces, so offsets into the result are offsets into text.
+    output = io.StringIO()
+    position = 0
+    for start, end, *_ in ranges:
+        output.write(text[position:start])
+        output.write(re.sub(r'[^\n]', ' ', text[start:end]))
+        position = end
+    output.write(text[position:])
+    return output.getvalue()
+
+
+def email_nlp_text(text, layout):
+    # The text spaCy reads for an email document: the same text with header
+    # blocks, quote markers and repeated paragraphs blanked out.
+    return blank_ranges(text, layout.hidden) if layout.hidden else text
+
+
+def iter_header_entries(text, start, end):
+    # Yield the (start, end) ranges of the comma or semicolon separated entries
+    # of an address header value, keeping "Lastname, Firstname" together.
+    entries = []
+    entry_start = start
+    depth = 0
+    quoted = False
+    for position in range(start, end + 1):
+        char = text[position] if position < end else ','
+        if char == '"':
+            quoted = not quoted
+        elif char == '<':
+            depth += 1
+        elif char == '>':
+            depth = max(depth - 1, 0)
+        elif char in ',;' and not quoted and not depth:
+            entries.append((entry_start, position))
+            entry_start = position + 1
+
+    merged = []
+    for entry_start, entry_end in entries:
+        entry = text[entry_start:entry_end].strip()
+        if merged and merged[-1][2] and entry and '@' not in entry.split('<')[0]:
+            merged[-1] = (merged[-1][0], entry_end, False)
+        else:
+            is_last_name = bool(re.fullmatch(r"[^\W\d_][\w'-]*", entry))
+            merged.append((entry_start, entry_end, is_last_name))
+    for entry_start, entry_end, _ in merged:
+        yield entry_start, entry_end
+
+
+def find_header_entry_spans(text, start, end):
+    # Mask the display name and the local part of the address of one header
+    # entry such as 'Doe, Jane <jane.doe@enron.com>' or 'jane.doe@enron.com'.
+    spans = []
+    entry = text[start:end]
+    address_start = entry.find('<')
+    if address_start == -1 and '@' in entry:
+        address_start = len(entry) - len(entry.lstrip())
+        address_end = len(entry.rstrip())
+        display_end = address_start
+    elif address_start == -1:
+        address_start = address_end = display_end = len(entry)
+    else:
+        display_end = address_start
+        address_start += 1
+        address_end = entry.find('>', address_start)
+        if address_end == -1:
+            address_end = len(entry)
+
+    display = entry[:display_end]
+    if process_name_comma_format(display):
+        if name_gazetteer is not None:
+            name_gazetteer.learn(display)
+        display_start = len(display) - len(display.lstrip(' \t"\''))
+        display_stop = len(display.rstrip(' \t"\''))
+        spans.append(Span(start + display_start, start + display_stop, 'name', 'email_header'))
+
+    if address_start < address_end:
+        address = entry[address_start:address_end]
+        if '@' in address:
+            local_start, local_end = address_start, address_start + address.index('@')
+        elif 'CN=' in address.upper():
+            # X.400 addresses end with the mailbox name
+            local_start = address_start + address.upper().rindex('CN=') + 3
+            local_end = address_end
+        else:
+            local_start = local_end = address_start
+        if local_start < local_end:
+            spans.append(Span(start + local_start, start + local_end, 'name', 'email_header'))
+    return [span._replace(end=clip_at_newline(text, span.start, span.end)[1]) for span in spans]
+
+
+def find_header_spans(text, layout, names=False, dates=False):
+    # Redact the names in the header fields of an email layout by parsing them,
+    # and with dates, the values of its date headers.
+    spans = []
+    for field in layout.fields:
+        if names and field.name in EMAIL_NAME_HEADERS:
+            for entry_start, entry_end in iter_header_entries(text, field.start, field.end):
+                spans.extend(find_header_entry_spans(text, entry_start, entry_end))
+        elif names and field.name in EMAIL_IDENTIFIER_HEADERS:
+            value = text[field.start:field.end]
+            if value.strip():
+                start = field.start + len(value) - len(value.lstrip())
+                spans.append(Span(*clip_at_newline(text, start, field.start + len(value.rstrip())), 'name', 'email_header'))
+        elif dates and field.name in EMAIL_DATE_HEADERS:
+            spans.extend(Span(match.start(), match.end(), 'date', 'email_header') for match in date_regex.finditer(text, field.start, field.end))
+    return spans
+
+
+def copy_repeated_spans(spans, repeats):
+    # Copy the spans found in a paragraph to the later paragraphs repeating it.
+    copies = []
+    for source_start, start, length in repeats:
+        offset = start - source_start
+        for span in spans:
+            if source_start <= span.start and span.end <= source_start + length:
+                copies.append(span._replace(start=span.start + offset, end=span.end + offset))
+    return copies
+
+
+class ParagraphCache:
+    # In-memory LRU cache of the spaCy-based spans found in a paragraph,
+    # relative to its start, so repeated paragraphs (quoted replies,
+    # signatures, disclaimers) are not parsed again.
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(paragraph, settings):
+        # Horizontal whitespace is normalized without changing offsets
+        normalized = re.sub(r'[^\S\n]', ' ', paragraph)
+        return hashlib.sha256(f'{settings!r}\0{normalized}'.encode('utf-8')).digest()
+
+    def get(self, key):
+        with self.lock:
+            spans = self.entries.get(key)
+            if spans is not None:
+                self.entries.move_to_end(key)
+            return spans
+
+    def put(self, key, spans):
+        with self.lock:
+            self.entries[key] = spans
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# Set by configure_paragraph_cache; None disables paragraph caching.
+paragraph_cache = None
+
+
+def configure_paragraph_cache(max_entries):
+    # Enable the paragraph cache with room for max_entries paragraphs, or disable it with None or 0.
+    global paragraph_cache
+    paragraph_cache = ParagraphCache(max_entries) if max_entries else None
+
+
+def doc_span_settings(names=False, dates=False, concepts=None, **options):
+    # Everything besides a paragraph's text that affects its spaCy-based spans.
+    date_ner = bool(dates) and date_engine(names=names, concepts=concepts) == 'ner'
+    return (nlp_settings['model'], bool(names), name_settings['verify'], date_ner, tuple(sorted(concepts or ())))
+
+
+# What spaCy reads for a document: the text (with email headers, repeated,
+# cached and triaged paragraphs blanked), the email layout, the spans of the
+# cached paragraphs, the (start, length, key) of the paragraphs to cache and
+# the (start, paragraph) of the paragraphs the triage kept from spaCy.
+NlpPlan = namedtuple('NlpPlan', ['text', 'layout', 'cached', 'misses', 'skipped'], defaults=((),))
+
+# Triage settings: when 'enabled', paragraphs without any sign of a name or
+# date are not sent to spaCy; 'audit' is the fraction of those paragraphs
+# that are parsed anyway to count the entities the triage missed.
+triage_settings = {
+    'enabled': False,
+    'audit': 0.0,
+}
+
+# Capitalized words, as names start with one (McDonald and O'Neil included).
+# Words in any script (O'Neil and Ólafur included); names are the ones
+# starting with a capital.
+word_regex = re.compile(r"[^\W\d_]+(?:['’-][^\W\d_]+)*")
+
+# Capitalized words that mostly start sentences and are never names. Words
+# that are also names, such as May or Will, are left out.
+TRIAGE_COMMON_WORDS = frozenset("""
+    a about after all also and any are as at be because before but by can could dear do does
+    for from have he her here hi his how i if in is it its let many my no not note of on or our
+    please re regards she should since so some thank thanks that the their then there these they
+    this those to we what when where which while who why with would yes you your
+""".split())
+
+# Words that start a date the NER finds besides the formats of date_regex.
+date_hint_regex = re.compile(
+    r'\b(?:(?:1[89]|20)\d\d|today|tonight|tomorrow|yesterday|weekend|weekly|week|monthly|month|'
+    r'annual|yearly|year|quarter|decade|century|morning|afternoon|evening|night|noon|ago|'
+    r'spring|summer|fall|autumn|winter|holiday|christmas|easter)s?\b',
+    re.IGNORECASE,
+)
+
+
+def configure_triage(enabled=None, audit=None):
+    # Turn the paragraph triage on or off and choose the fraction of skipped paragraphs audited.
+    if enabled is not None:
+        triage_settings['enabled'] = bool(enabled)
+    if audit is not None:
+        if not 0 <= audit <= 1:
+            raise ValueError('audit must be between 0 and 1')
+        triage_settings['audit'] = audit
+
+
+def uses_triage(names=False, dates=False, concepts=None, **options):
+    # Whether the triage applies: concepts can match any sentence, so only
+    # name and NER date detection can skip paragraphs. With the parse cache
+    # whole documents are parsed, so a saved parse serves runs with any flags.
+    return (triage_settings['enabled'] and not concepts and doc_cache is None
+            and needs_doc(names=names, dates=dates, concepts=concepts))
+
+
+def might_contain_entities(paragraph, names=False, date_ner=False):
+    # Cheap check for whether spaCy could find a name or a date in a paragraph:
+    # a capitalized word that is not a common sentence starter, an all-caps
+    # word, a known name, or a date format, date word or year.
+    if names:
+        for match in word_regex.finditer(paragraph):
+            word = match.group()
+            if word[0].isupper() and ((len(word) > 1 and word.isupper()) or word.lower() not in TRIAGE_COMMON_WORDS):
+                return True
+        if name_gazetteer is not None and name_gazetteer.find_spans(paragraph):
+            return True
+    if date_ner:
+        if date_regex.search(paragraph) or date_hint_regex.search(paragraph):
+            return True
+    return False
+
+
+def triage_paragraphs(nlp_text, names=False, dates=False, concepts=None):
+    # Find the paragraphs the triage keeps from spaCy. Returns their
+    # (start, paragraph) pairs.
+    date_ner = bool(dates) and date_engine(names=names, concepts=concepts) == 'ner'
+    skipped = []
+    paragraphs = 0
+    for match in paragraph_regex.finditer(nlp_text):
+        paragraph = match.group().rstrip()
+        paragraphs += 1
+        if not might_contain_entities(paragraph, names=names, date_ner=date_ner):
+            skipped.append((match.start(), paragraph))
+    count_detail('triage', 'paragraphs', paragraphs)
+    count_detail('triage', 'skipped', len(skipped))
+    return skipped
+
+
+def audit_triage(skipped, names=False, date_ner=False):
+    # Parse a sample of the paragraphs the triage skipped, chosen by a hash of
+    # their text, and count the names and dates spaCy would have found in them.
+    threshold = triage_settings['audit'] * (1 << 32)
+    for _, paragraph in skipped:
+        if zlib.crc32(paragraph.encode('utf-8')) >= threshold:
+            continue
+        doc = get_nlp()(paragraph)
+        missed = 0
+        if names:
+            missed += len(find_entity_name_spans(paragraph, doc=doc))
+        if date_ner:
+            missed += len(find_ner_date_spans(paragraph, doc=doc))
+        count_detail('triage', 'audited')
+        count_detail('triage', 'missed', missed)
+
+
+def plan_nlp(text, names=False, dates=False, concepts=None, use_cache=True, **options):
+    # Work out what spaCy has to read for a document, leaving out the
+    # paragraphs the triage rules out and looking the others up in the
+    # paragraph cache. With the parse cache neither applies, so the text
+    # parsed, which keys the saved parse, depends on the document alone.
+    layout = None
+    nlp_text = text
+    if email_settings['headers'] and (names or dates or concepts):
+        with profile_stage('headers'):
+            layout = parse_email_layout(text)
+            nlp_text = email_nlp_text(text, layout)
+
+    skipped = ()
+    if uses_triage(names=names, dates=dates, concepts=concepts):
+        with profile_stage('triage'):
+            skipped = triage_paragraphs(nlp_text, names=names, dates=dates, concepts=concepts)
+            if skipped:
+                nlp_text = blank_ranges(nlp_text, [(start, start + len(paragraph)) for start, paragraph in skipped])
+
+    cached = []
+    misses = []
+    if use_cache and paragraph_cache is not None and doc_cache is None and needs_doc(names=names, dates=dates, concepts=concepts):
+        with profile_stage('paragraph_cache'):
+            settings = doc_span_settings(names=names, dates=dates, concepts=concepts)
+            hits = []
+            for match in paragraph_regex.finditer(nlp_text):
+                paragraph = match.group().rstrip()
+                key = paragraph_cache.key(paragraph, settings)
+                relative_spans = paragraph_cache.get(key)
+                if relative_spans is None:
+                    misses.append((match.start(), len(paragraph), key))
+                    continue
+                hits.append((match.start(), match.start() + len(paragraph)))
+                cached.extend(Span(match.start() + start, match.start() + end, span_type, detector)
+                              for start, end, span_type, detector in relative_spans)
+            count_detail('paragraph_cache', 'hits', len(hits))
+            count_detail('paragraph_cache', 'misses', len(misses))
+            if hits:
+                nlp_text = blank_ranges(nlp_text, hits)
+    return NlpPlan(nlp_text, layout, cached, misses, skipped)
+
+
+def store_paragraph_spans(plan, doc_spans):
+    # Cache the spans found in the paragraphs that missed the paragraph cache.
+    if not plan.misses:
+        return
+    spans = sorted(doc_spans, key=span_order)
+    starts = [span.start for span in spans]
+    for start, length, key in plan.misses:
+        relative_spans = []
+        for span in spans[bisect.bisect_left(starts, start):]:
+            if span.start >= start + length:
+                break
+            if span.end <= start + length:
+                relative_spans.append((span.start - start, span.end - start, span.type, span.detector))
+        paragraph_cache.put(key, tuple(relative_spans))
+
+
+class DocCache:
+    # On-disk cache of parsed spaCy Docs in SQLite, serialized with DocBin and
+    # keyed by a hash of the model, its version, its pipeline components and
+    # the text parsed. That text is the document with only its email headers
+    # blanked (see plan_nlp), so a later run with other redaction flags or
+    # concepts reads the saved parse instead of running the pipeline again. The least
+    # recently used Docs are evicted once the cache holds more than max_bytes.
+
+    def __init__(self, path, max_bytes=2 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._pipeline = None
+
+    def connection(self):
+        # One connection per thread of each process, as in GNLPCache.
+        local = self._local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS docs ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, last_used REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS docs_last_used ON docs (last_used)')
+            connection.commit()
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def key(self, text):
+        if self._pipeline is None:
+            model = nlp_settings['model']
+            self._pipeline = f'{model}\0{model_version(model)}\0{",".join(get_nlp().pipe_names)}'
+        return hashlib.sha256(f'{self._pipeline}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        # Return the cached Doc of the text, or None.
+        from spacy.tokens import DocBin
+        key = self.key(text)
+        connection = self.connection()
+        row = connection.execute('SELECT value FROM docs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE docs SET last_used = ? WHERE key = ?', (time.time(), key))
+        connection.commit()
+        return next(DocBin().from_bytes(row[0]).get_docs(get_nlp().vocab))
+
+    def put(self, text, doc):
+        from spacy.tokens import DocBin
+        value = DocBin(docs=[doc]).to_bytes()
+        connection = self.connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO docs (key, value, size, last_used) VALUES (?, ?, ?, ?)',
+            (self.key(text), value, len(value), time.time()),
+        )
+        (total,) = connection.execute('SELECT COALESCE(SUM(size), 0) FROM docs').fetchone()
+        if total > self.max_bytes:
+            evicted = []
+            for key, size in connection.execute('SELECT key, size FROM docs ORDER BY last_used'):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                total -= size
+            connection.executemany('DELETE FROM docs WHERE key = ?', evicted)
+        connection.commit()
+
+
+# Set by configure_doc_cache; None disables the parse cache.
+doc_cache = None
+
+
+def configure_doc_cache(path, max_bytes=2 << 30):
+    # Enable the on-disk parse cache, or disable it when path is None.
+    global doc_cache
+    doc_cache = DocCache(path, max_bytes=max_bytes) if path else None
+
+
+def find_cached_doc(text):
+    # The cached Doc of a text, counting the lookup in the file's details.
+    if doc_cache is None:
+        return None
+    doc = doc_cache.get(text)
+    count_detail('doc_cache', 'misses' if doc is None else 'hits')
+    return doc
+
+
+def parse_document(text):
+    # Parse a document once so every spaCy-based redactor can read from the
+    # same Doc, going through the parse cache when it is enabled.
+    with profile_stage('parse'):
+        doc = find_cached_doc(text)
+        if doc is None:
+            doc = get_nlp()(text)
+            if doc_cache is not None:
+                doc_cache.put(text, doc)
+        return doc
+
+
+def parse_documents(texts, batch_size=1000):
+    # Parse several documents in one streamed nlp.pipe call. The Docs of the
+    # texts are saved to the parse cache when it is enabled.
+    if doc_cache is None:
+        return get_nlp().pipe(texts, batch_size=batch_size)
+    texts = list(texts)
+    docs = list(get_nlp().pipe(texts, batch_size=batch_size))
+    for text, doc in zip(texts, docs):
+        doc_cache.put(text, doc)
+    return docs
+
+
+def needs_spacy(names=False, dates=False, concepts=None, **options):
+    # Whether any of the enabled redactors uses the spaCy pipeline.
+    return bool(names or concepts or needs_date_ner(names=names, dates=dates, concepts=concepts))
+
+
+def needs_doc(names=False, dates=False, concepts=None, **options):
+    # Whether any of the enabled redactors reads from a spaCy Doc of the whole
+    # document (rule-based dates only parse the lines they need confirmed).
+    return bool(names or concepts or (dates and date_engine(names=names, concepts=concepts) == 'ner'))
+
+
+def detect_spans(text, names=False, dates=False, phones=False, address=False, concepts=None, doc=None, plan=None):
+    # Collect the spans of every enabled redactor for one document. The spaCy
+    # pipeline runs at most once per document, on the text planned by
+    # plan_nlp; a Doc already parsed from it can be passed in with its plan.
+    # The regex-based redactors scan a view of the text with earlier spans
+    # masked, as they did when each redactor rewrote the text in turn.
+    if plan is None:
+        plan = plan_nlp(text, names=names, dates=dates, concepts=concepts, use_cache=doc is None)
+    layout = plan.layout
+    date_rules = bool(dates) and date_engine(names=names, concepts=concepts) == 'rules'
+    if doc is None and needs_doc(names=names, dates=dates, concepts=concepts) and not plan.text.isspace():
+        doc = parse_document(plan.text)
+
+    spans = []
+    if layout and (names or dates):
+        with profile_stage('headers'):
+            # Dates found by the rules are found in the headers as well
+            spans.extend(find_header_spans(text, layout, names=names, dates=dates and not date_rules))
+
+    if date_rules:
+        with profile_stage('dates'):
+            # Ambiguous dates in cached or triaged paragraphs are confirmed on their own lines
+            spans.extend(find_rule_date_spans(text, doc=None if plan.cached or plan.skipped else doc))
+
+    doc_spans = []
+    if doc is not None:
+        if names:
+            with profile_stage('names'):
+                doc_spans.extend(find_entity_name_spans(text, doc=doc))
+
+        if dates and not date_rules:
+            with profile_stage('dates'):
+                doc_spans.extend(find_ner_date_spans(text, doc=doc))
+
+        if concepts:
+            with profile_stage('concepts'):
+                doc_spans.extend(find_concept_spans(text, concepts, doc=doc))
+
+    if plan.skipped and triage_settings['audit']:
+        with profile_stage('triage'):
+            audit_triage(plan.skipped, names=names, date_ner=bool(dates) and not date_rules)
+
+    if plan.misses:
+        store_paragraph_spans(plan, doc_spans)
+    doc_spans.extend(plan.cached)
+    if layout and layout.repeats:
+        doc_spans.extend(copy_repeated_spans(doc_spans, layout.repeats))
+    spans.extend(span for span in doc_spans if span.type != 'concept')
+    concept_spans = [span for span in doc_spans if span.type == 'concept']
+
+    if names and name_gazetteer is not None:
+        with profile_stage('gazetteer'):
+            # Learn the names spaCy found, then mask every known name
+            for span in doc_spans:
+                if span.type == 'name':
+                    name_gazetteer.learn(text[span.start:span.end])
+            spans.extend(drop_overlapping_spans(name_gazetteer.find_spans(text), spans))
+
+    if names or phones or address:
+        # Email local parts, phone numbers and address formats in a single pass
+        with profile_stage('patterns'):
+            view = render_masked_text(text, spans) if spans else text
+            pattern_spans = scan_pattern_spans(view, emails=names, phones=phones, addresses=address)
+            spans.extend(span for span in pattern_spans if span.type != 'address')
+
+    if address:
+        with profile_stage('addresses'):
+            view = render_masked_text(text, spans) if spans else text
+            address_spans = [span for span in pattern_spans if span.type == 'address']
+            spans.extend(find_address_spans(view, pattern_spans=address_spans))
+
+    return spans + concept_spans
+
+
+def redact_text(text, doc=None, plan=None, span_sink=None, **options):
+    # Apply every enabled redactor to a document and return the masked text with
+    # per-type counts. All spans are gathered first and the output is written
+    # in one pass, in the configured mask style. span_sink, when given, is
+    # called with the list of spans before rendering.
+    spans = detect_spans(text, doc=doc, plan=plan, **options)
+    if span_sink is not None:
+        span_sink(spans)
+    with profile_stage('render'):
+        return render_masked_text(text, spans, mask_settings['style']), count_spans(spans)
+
+
+def redaction_options(args):
+    # Keyword arguments for redact_text taken from the parsed command line.
+    return {
+        'names': args.names,
+        'dates': args.dates,
+        'phones': args.phones,
+        'address': args.address,
+        'concepts': args.concept,
+    }
+
+
+# Compressed files are read and written through these openers, by extension.
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+# Errors that mean an input file could not be read or decoded.
+READ_ERRORS = (OSError, EOFError, UnicodeDecodeError, lzma.LZMAError)
+
+output_settings = {
+    'compression': 'same',  # 'same' as the input, 'none', or one of the COMPRESSED_OPENERS extensions
+}
+
+
+def configure_output(compression=None):
+    # Choose how output files are compressed.
+    if compression is not None:
+        if compression not in ('same', 'none') and '.' + compression not in COMPRESSED_OPENERS:
+            raise ValueError(f'Unknown compression: {compression}')
+        output_settings['compression'] = compression
+
+
+def compression_of(file_path):
+    # Compression extension of a file ('' when it is not compressed).
+    extension = os.path.splitext(file_path)[1].lower()
+    return extension if extension in COMPRESSED_OPENERS else ''
+
+
+def open_text(file_path, mode='r'):
+    # Open a UTF-8 text file, compressed or not as its extension says.
+    opener = COMPRESSED_OPENERS.get(compression_of(file_path))
+    if opener is not None:
+        return opener(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+
+@contextlib.contextmanager
+def atomic_output(file_path):
+    # Open a text file for writing through a temporary file that only replaces
+    # file_path once it is complete, so readers never see half a file.
+    directory, name = os.path.split(file_path)
+    temp_path = os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    opener = COMPRESSED_OPENERS.get(compression_of(file_path))
+    f = opener(temp_path, 'wt', encoding='utf-8') if opener else open(temp_path, 'w', encoding='utf-8')
+    try:
+        with f:
+            yield f
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, file_path)
+
+
+def write_output_file(file_path, text):
+    # Write one redacted file atomically.
+    with atomic_output(file_path) as f:
+        f.write(text)
+
+
+class OutputWriter:
+    # Writes redacted files on a background thread, so the next batch is
+    # redacted while the previous one is written. At most max_pending files
+    # wait in the queue; with max_pending 0 files are written by the caller.
+    def __init__(self, max_pending=8):
+        self.failed = []
+        self.queue = None
+        if max_pending > 0:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self.run, name='output-writer', daemon=True)
+            self.thread.start()
+
+    def write(self, file_path, text):
+        if self.queue is None:
+            self.write_now(file_path, text)
+        else:
+            self.queue.put((file_path, text))
+
+    def write_now(self, file_path, text):
+        # Any failure is recorded, so the background thread keeps emptying the queue
+        try:
+            write_output_file(file_path, text)
+        except Exception as e:
+            print(f'Error writing file {file_path}: {e}', file=sys.stderr)
+            self.failed.append(file_path)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.write_now(*item)
+
+    def close(self):
+        # Wait for the queued files to be written. Returns the output paths that could not be written.
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+        return self.failed
+
+
+def read_input_file(file_path):
+    # Read one input file, reporting failures on stderr and returning None.
+    try:
+        with profile_stage('read'), open_text(file_path) as f:
+            return f.read()
+    except Exception as e:
+        print(f'Error reading file {file_path}: {e}', file=sys.stderr)
+        return None
+
+
+_request_executor = None
+_request_executor_pid = None
+
+
+def get_request_executor():
+    # Thread pool that keeps up to gnlp_settings['concurrency'] documents waiting
+    # on entity requests at once. Each process owns its pool.
+    global _request_executor, _request_executor_pid
+    if _request_executor is None or _request_executor_pid != os.getpid():
+        _request_executor = concurrent.futures.ThreadPoolExecutor(max_workers=gnlp_settings['concurrency'])
+        _request_executor_pid = os.getpid()
+    return _request_executor
+
+
+def redact_with_details(text, doc, plan, options, details, file_path=None):
+    # redact_text, collecting a file's details and writing its span index when
+    # one is configured. Returns (redacted_text, counts, details).
+    found = []
+    span_sink = found.extend if file_path and span_index_settings['directory'] else None
+    with collect_details(details):
+        redacted, counts = redact_text(text, doc=doc, plan=plan, span_sink=span_sink, **options)
+    if span_sink is not None:
+        write_span_index(file_path, text, found, counts)
+    return redacted, counts, details
+
+
+def redaction_parses(options):
+    # Whether redact_text may run the spaCy pipeline for documents start_batch
+    # has already parsed: with profiling the documents are parsed by
+    # redact_text, ambiguous rule-based dates are confirmed by parsing their
+    # lines, and the triage audit parses skipped paragraphs. The pipeline is
+    # not safe to share between threads, so such documents are not redacted
+    # on the request executor.
+    if profiling['enabled'] and needs_doc(**options):
+        return True
+    if options.get('dates') and date_settings['confirm'] \
+            and date_engine(names=options.get('names'), concepts=options.get('concepts')) == 'rules':
+        return True
+    return bool(triage_settings['audit']) and uses_triage(**options)
+
+
+def start_batch(file_paths, options):
+    # Read a batch of files, stream their texts through nlp.pipe and start
+    # redacting them. Returns a list of (file_path, future) whose results are
+    # (redacted_text, counts, details); files that could not be read are
+    # skipped. When addresses are enabled the documents are redacted on the
+    # request executor, so their entity requests are in flight while the
+    # caller moves on, unless redacting them may run the pipeline (see
+    # redaction_parses). With profiling on, documents are parsed one at a time
+    # so parse time can be attributed to each file.
+    loaded = []
+    for file_path in file_paths:
+        with collect_details() as details:
+            text = read_input_file(file_path)
+        if text is not None:
+            loaded.append((file_path, text, details))
+
+    texts = [text for _, text, _ in loaded]
+    plans = [None] * len(texts)
+    docs = [None] * len(texts)
+    if needs_doc(**options) and not profiling['enabled']:
+        # (With profiling, documents are parsed by redact_text, inside the file's profile)
+        for i, (_, text, details) in enumerate(loaded):
+            with collect_details(details):
+                plans[i] = plan_nlp(text, **options)
+                docs[i] = find_cached_doc(plans[i].text)
+        missing = [i for i, doc in enumerate(docs) if doc is None]
+        parsed = parse_documents([plans[i].text for i in missing], batch_size=max(len(missing), 1))
+        for i, doc in zip(missing, parsed):
+            docs[i] = doc
+
+    in_background = options.get('address') and gnlp_settings['concurrency'] > 1 and not redaction_parses(options)
+    if in_background and options.get('concepts'):
+        # Embed the concepts here so worker threads never run the pipeline
+        get_concept_vectors(tuple(options['concepts']))
+
+    pending = []
+    for (file_path, text, details), doc, plan in zip(loaded, docs, plans):
+        if in_background:
+            future = get_request_executor().submit(redact_with_details, text, doc, plan, options, details, file_path)
+        else:
+            future = concurrent.futures.Future()
+            future.set_result(redact_with_details(text, doc, plan, options, details, file_path))
+        pending.append((file_path, future))
+    return pending
+
+
+def finish_batch(pending):
+    # Wait for a batch started by start_batch and return (file_path, redacted_text, counts, details) tuples.
+    results = []
+    for file_path, future in pending:
+        text, counts, details = future.result()
+        results.append((file_path, text, counts, details))
+    return results
+
+
+def process_batch(file_paths, options):
+    # Read and redact a batch of files, streaming their texts through nlp.pipe.
+    # Returns a list of (file_path, redacted_text, counts, details); files that
+    # could not be read are skipped. details holds the file's stage profile
+    # when profiling and its paragraph cache hits and misses.
+    return finish_batch(start_batch(file_paths, options))
+
+
+def iter_batches(items, batch_size):
+    # Split a list into consecutive batches of at most batch_size items.
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def iter_processed_files(input_files, options, workers=1, batch_size=16):
+    # Yield (file_path, redacted_text, counts, details) for every readable input file, in
+    # input order. With more than one worker the batches are spread over a pool
+    # of forked processes; the pool is created after the spaCy model is loaded
+    # so the workers share its memory pages through copy-on-write. A single
+    # process parses the next batch while the previous one waits on entity
+    # requests.
+    batches = iter_batches(input_files, batch_size)
+    if workers <= 1:
+        pending = deque()
+        for batch in batches:
+            pending.append(start_batch(batch, options))
+            if len(pending) > 1:
+                yield from finish_batch(pending.popleft())
+        while pending:
+            yield from finish_batch(pending.popleft())
+        return
+
+    # Load the model (and embed the concepts) before forking so workers share them
+    warm_up(options)
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes=workers) as pool:
+        for results in pool.imap(functools.partial(process_batch, options=options), batches):
+            yield from results
+
+
+def find_chunk_end(text, start, limit):
+    # Pick where a chunk of text[start:limit] should end, preferring a paragraph
+    # break, then a line break, then a sentence end and finally any whitespace.
+    # The boundary is searched for in the second half of the range so chunks
+    # stay close to their target size.
+    lower = start + (limit - start) // 2
+    for separator in ('\n\n', '\n', '. ', ' '):
+        position = text.rfind(separator, lower, limit)
+        if position != -1:
+            return position + len(separator)
+    return limit
+
+
+def redact_stream(input_stream, output_stream, options, chunk_size=100000, overlap=1000, span_sink=None):
+    # Redact text read from input_stream chunk by chunk, writing the output as
+    # it goes so memory stays bounded by the chunk size. Chunks end at paragraph
+    # (or line, sentence, word) boundaries and each one is redacted together
+    # with `overlap` characters of context on both sides:
+    #  - the last `overlap` characters of a chunk are only written once the
+    #    next chunk has been redacted, so an entity crossing a chunk boundary is
+    #    seen whole by one of them;
+    #  - spans are counted by the chunk whose written region they start in, and
+    #    spans found twice are merged, so nothing is counted or masked twice.
+    # span_sink, when given, is called with every span (in absolute offsets)
+    # that is masked. Returns the per-type counts for the whole stream.
+    if overlap * 2 >= chunk_size:
+        raise ValueError('chunk_size must be more than twice the overlap')
+    style = mask_settings['style']
+    if style == 'type':
+        raise ValueError('the type mask style changes the text length and cannot be streamed')
+
+    counts = count_spans([])
+    buffer = ''          # Original text from buffer_start onwards
+    buffer_start = 0
+    emitted = 0          # Everything before this offset has been written
+    active = []          # Spans (absolute offsets) that reach past `emitted`
+    at_eof = False
+
+    while True:
+        # Window of text to redact: left context plus up to chunk_size new characters
+        window_start = max(emitted - overlap, 0)
+        limit = window_start + chunk_size
+        while not at_eof and buffer_start + len(buffer) < limit:
+            block = input_stream.read(chunk_size)
+            if not block:
+                at_eof = True
+            buffer += block
+        buffer_end = buffer_start + len(buffer)
+
+        if at_eof and buffer_end <= limit:
+            window_end = emit_end = buffer_end
+        else:
+            window_end = buffer_start + find_chunk_end(buffer, emitted + overlap - buffer_start, limit - buffer_start)
+            emit_end = window_end - overlap
+
+        window_text = buffer[window_start - buffer_start:window_end - buffer_start]
+        carried = list(active)
+        for span in detect_spans(window_text, **options):
+            span = span._replace(start=span.start + window_start, end=span.end + window_start)
+            # Spans starting in the held-back tail are left to the next window
+            if span.start >= emit_end:
+                continue
+            if span.start < emitted:
+                # The previous window already handled the left context; only
+                # extend spans it had to cut short at its edge
+                if any(other.start < span.end and span.start < other.end for other in carried):
+                    active.append(span)
+                    if span_sink is not None:
+                        span_sink(span)
+                continue
+            if any(other.start <= span.start and span.end <= other.end for other in carried):
+                continue  # Found again by this window
+            active.append(span)
+            if span_sink is not None:
+                span_sink(span)
+            counts[SPAN_TYPE_STATS[span.type]] += 1
+
+        # Write the finished region and keep the spans that continue past it
+        region = buffer[emitted - buffer_start:emit_end - buffer_start]
+        region_spans = [
+            span._replace(start=max(span.start, emitted) - emitted, end=min(span.end, emit_end) - emitted)
+            for span in active
+        ]
+        output_stream.write(render_masked_text(region, region_spans, style))
+        active = [span for span in active if span.end > emit_end]
+        emitted = emit_end
+
+        if emitted >= buffer_end and at_eof:
+            return counts
+
+        # Drop text that no later window will look at
+        keep_from = max(emitted - overlap, 0)
+        buffer = buffer[keep_from - buffer_start:]
+        buffer_start = keep_from
+
+
+def stream_file(file_path, output_file_path, options, chunk_size=100000, overlap=1000):
+    # Redact one file in streaming mode, writing its span index as the spans
+    # are found when one is configured. Returns (file_path, counts, details),
+    # or None when the file could not be read or its output written.
+    index = None
+    source = reader = None
+    try:
+        with collect_details() as details, \
+                open_text(file_path) as source, \
+                atomic_output(output_file_path) as target:
+            source = reader = CheckedReader(source)
+            span_sink = None
+            if span_index_settings['directory']:
+                source = HashingReader(source)
+                index = SpanIndexWriter(file_path)
+                span_sink = index.add
+            counts = redact_stream(source, target, options, chunk_size=chunk_size, overlap=overlap, span_sink=span_sink)
+        if index is not None:
+            index.close(source.hexdigest(), counts)
+    except READ_ERRORS as e:
+        if index is not None:
+            index.discard()
+        # Anything but a failed open or read of the input is an output error
+        if source is None or reader is not None and reader.failed:
+            print(f'Error reading file {file_path}: {e}', file=sys.stderr)
+        else:
+            print(f'Error writing file {output_file_path}: {e}', file=sys.stderr)
+        return None
+    return file_path, counts, details
+
+
+def iter_streamed_files(input_files, output_dir, options, workers=1, chunk_size=100000, overlap=1000):
+    # Yield (file_path, output_file_path, counts, details) for every input file
+    # redacted in streaming mode, optionally spreading files over forked worker
+    # processes.
+    jobs = [(file_path, output_file_path_for(file_path, output_dir)) for file_path in input_files]
+    stream = functools.partial(stream_job, options=options, chunk_size=chunk_size, overlap=overlap)
+    if workers <= 1:
+        yield from (result for result in map(stream, jobs) if result is not None)
+        return
+
+    warm_up(options)
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes=workers) as pool:
+        # Results arrive file by file, in input order, as the workers finish them
+        yield from (result for result in pool.imap(stream, jobs) if result is not None)
+
+
+def stream_job(job, options, chunk_size=100000, overlap=1000):
+    # Redact one (file_path, output_file_path) job of iter_streamed_files and
+    # return (file_path, output_file_path, counts, details), or None.
+    file_path, output_file_path = job
+    result = stream_file(file_path, output_file_path, options, chunk_size=chunk_size, overlap=overlap)
+    if result is None:
+        return None
+    return file_path, output_file_path, result[1], result[2]
+
+
+def output_file_path_for(file_path, output_dir):
+    # Where the censored version of an input file is written. A compressed
+    # input such as notes.txt.gz gives notes.txt.censored.gz, unless another
+    # output compression is configured.
+    name = os.path.basename(file_path)
+    compression = compression_of(name)
+    name = name[:len(name) - len(compression)]
+    if output_settings['compression'] == 'none':
+        compression = ''
+    elif output_settings['compression'] != 'same':
+        compression = '.' + output_settings['compression']
+    return os.path.join(output_dir, name + '.censored' + compression)
+
+
+span_index_settings = {
+    'directory': None,
+}
+
+SPAN_INDEX_VERSION = 1
+
+
+def configure_span_index(directory=None):
+    # Write a span index next to every redacted file into this directory (None to stop).
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    span_index_settings['directory'] = directory or None
+
+
+def span_index_path_for(file_path, index_dir):
+    # Where the span index of an input file is written.
+    return os.path.join(index_dir, os.path.basename(file_path) + '.spans.jsonl')
+
+
+def text_sha256(text):
+    # Hex digest of a decoded text, as span indexes record it.
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class CheckedReader:
+    # Wraps a text stream and remembers whether a read failed, so the errors of
+    # a file streamed to its output can be told apart from those of the output.
+    def __init__(self, stream):
+        self.stream = stream
+        self.failed = False
+
+    def read(self, size=-1):
+        try:
+            return self.stream.read(size)
+        except BaseException:
+            self.failed = True
+            raise
+
+
+class HashingReader:
+    # Wraps a text stream and hashes what is read from it, so a file streamed
+    # once can still be recorded in its span index.
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        block = self.stream.read(size)
+        self.digest.update(block.encode('utf-8'))
+        return block
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class SpanIndexWriter:
+    # Writes one file's span index as JSON lines: a header naming the file,
+    # one [start, end, type, detector] line per span and a trailer with the
+    # text hash and counts. Offsets are characters of the decoded text. Spans
+    # go to a temporary file that only replaces the index once it is complete.
+    def __init__(self, file_path, index_dir=None):
+        index_dir = index_dir or span_index_settings['directory']
+        self.path = span_index_path_for(file_path, index_dir)
+        self.temp_path = self.path + '.tmp'
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        self.write({'version': SPAN_INDEX_VERSION, 'file': os.path.abspath(file_path)})
+
+    def write(self, value):
+        self.file.write(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+        self.file.write('\n')
+
+    def add(self, span):
+        self.write([span.start, span.end, span.type, span.detector])
+
+    def close(self, sha256, counts):
+        self.write({'sha256': sha256, 'counts': counts})
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+
+def write_span_index(file_path, text, spans, counts, index_dir=None):
+    # Write the span index of a document redacted in one piece.
+    index = SpanIndexWriter(file_path, index_dir)
+    for span in sorted(spans, key=span_order):
+        index.add(span)
+    index.close(text_sha256(text), counts)
+
+
+def read_span_index(index_path):
+    # Read a span index written by SpanIndexWriter. Returns (header, spans,
+    # trailer) and raises ValueError when the index is incomplete.
+    with open(index_path, 'r', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if len(lines) < 2 or not isinstance(lines[0], dict) or not isinstance(lines[-1], dict) \
+            or 'counts' not in lines[-1]:
+        raise ValueError(f'Incomplete span index: {index_path}')
+    if lines[0].get('version') != SPAN_INDEX_VERSION:
+        raise ValueError(f'Unsupported span index version in {index_path}')
+    spans = [Span(*entry) for entry in lines[1:-1]]
+    return lines[0], spans, lines[-1]
+
+
+def replay_file(file_path, output_file_path, index_dir):
+    # Render a file again from its saved span index, in the configured mask
+    # style, without running any detector. Returns the stored counts, or None
+    # when the file or its index cannot be used.
+    index_path = span_index_path_for(file_path, index_dir)
+    text = read_input_file(file_path)
+    if text is None:
+        return None
+    try:
+        _, spans, trailer = read_span_index(index_path)
+    except (OSError, ValueError) as e:
+        print(f'Error reading span index {index_path}: {e}', file=sys.stderr)
+        return None
+    if trailer['sha256'] != text_sha256(text):
+        print(f'Skipping {file_path}: it changed since {index_path} was written', file=sys.stderr)
+        return None
+    with profile_stage('render'):
+        redacted = render_masked_text(text, spans, mask_settings['style'])
+    with profile_stage('write'):
+        write_output_file(output_file_path, redacted)
+    return trailer['counts']
+
+
+def file_sha256(file_path):
+    # Hex digest of a file's contents, read in blocks.
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_version(model):
+    # Version of a spaCy model package, or of a model directory from its meta.json.
+    meta_path = os.path.join(model, 'meta.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('version', 'unknown')
+    try:
+        from importlib import metadata
+        return metadata.version(model)
+    except Exception:
+        return 'unknown'
+
+
+def run_fingerprint(options):
+    # Everything besides the input text that affects a file's redacted output.
+    fingerprint = {
+        'options': {
+            key: sorted(value) if key == 'concepts' and value else value
+            for key, value in options.items()
+        },
+    }
+    if needs_spacy(**options):
+        fingerprint['model'] = nlp_settings['model']
+        fingerprint['model_version'] = model_version(nlp_settings['model'])
+    if options.get('address'):
+        fingerprint['entity_backend'] = gnlp_settings['backend']
+    if email_settings['headers']:
+        fingerprint['email_headers'] = True
+    if options.get('names'):
+        fingerprint['name_gazetteer'] = name_gazetteer is not None
+        fingerprint['verify_names'] = name_settings['verify']
+    if options.get('dates'):
+        fingerprint['date_engine'] = date_engine(names=options.get('names'), concepts=options.get('concepts'))
+        fingerprint['date_confirm'] = date_settings['confirm']
+    if uses_triage(**options):
+        fingerprint['triage'] = True
+    if mask_settings['style'] != 'block':
+        fingerprint['mask_style'] = mask_settings['style']
+    if span_index_settings['directory']:
+        # Rerun files once so every one of them gets an index
+        fingerprint['span_index'] = True
+    return fingerprint
+
+
+def load_manifest(manifest_path):
+    # Read an incremental-run manifest, starting empty when there is none yet.
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path, manifest):
+    # Write the manifest through a temporary file so a crash never leaves it half written.
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_path, manifest_path)
+
+
+def split_unchanged_files(input_files, output_dir, manifest, fingerprint):
+    # Split the input files into those that must be redacted and those whose
+    # content, run settings and output are unchanged since the manifest was
+    # written. Returns (changed, unchanged, hashes); unchanged holds
+    # (file_path, manifest entry) pairs and hashes maps every readable input
+    # file to its content hash.
+    changed = []
+    unchanged = []
+    hashes = {}
+    for file_path in input_files:
+        try:
+            hashes[file_path] = file_sha256(file_path)
+        except OSError:
+            changed.append(file_path)  # Reported as unreadable when it is processed
+            continue
+        entry = manifest['files'].get(os.path.abspath(file_path))
+        if (entry is not None
+                and entry['sha256'] == hashes[file_path]
+                and entry['config'] == fingerprint
+                and entry['output'] == output_file_path_for(file_path, output_dir)
+                and os.path.exists(entry['output'])):
+            unchanged.append((file_path, entry))
+        else:
+            changed.append(file_path)
+    return changed, unchanged, hashes
+
+
+def build_file_stat(counts):
+    # Per-file statistics entry for the counts returned by redact_text.
+    file_stat = {
+        'redactions': 0,
+        'redaction_counts': {
+            'names': 0,
+            'dates': 0,
+            'phones': 0,
+            'addresses': 0,
+            'concepts': 0,
+        }
+    }
+    for redaction_type, count in counts.items():
+        file_stat['redactions'] += count
+        file_stat['redaction_counts'][redaction_type] += count
+    return file_stat
+
+
+# Statistics sections of counters summed over files: the hits and misses of
+# the caches and the paragraphs seen, skipped and audited by the triage.
+COUNTER_SECTIONS = {
+    'paragraph_cache': ('hits', 'misses'),
+    'doc_cache': ('hits', 'misses'),
+    'triage': ('paragraphs', 'skipped', 'audited', 'missed'),
+}
+
+
+def add_counters(statistics, section, counters):
+    # Add a file's counters to a counter section of the statistics.
+    totals = statistics.setdefault(section, dict.fromkeys(COUNTER_SECTIONS[section], 0))
+    for key in COUNTER_SECTIONS[section]:
+        totals[key] += counters.get(key, 0)
+    if section == 'triage':
+        # The share of paragraphs kept from spaCy
+        totals['skip_rate'] = totals['skipped'] / totals['paragraphs'] if totals['paragraphs'] else 0.0
+    return totals
+
+
+def file_stats_key(file_path):
+    # Key of a file in file_stats: its path as matched by the input patterns,
+    # so files with the same name in different directories stay apart.
+    return os.path.normpath(file_path)
+
+
+def record_file_stats(statistics, file_path, counts, details=None, stats_log=None):
+    # Add the counts and details (the stage profile when profiling, paragraph
+    # and parse cache hits and misses) of one processed file, possibly from a
+    # worker process, to the run statistics.
+    file_stat = build_file_stat(counts)
+    details = details or {}
+    profile = details.get('profile')
+    if profile is not None:
+        file_stat['profile'] = profile
+        for hook in profile_hooks:
+            hook(file_path, profile)
+    for section in COUNTER_SECTIONS:
+        if section in statistics:
+            file_stat[section] = add_counters({}, section, details.get(section, {}))
+    add_file_stat(statistics, file_stats_key(file_path), file_stat, stats_log=stats_log)
+
+
+def add_file_stat(statistics, key, file_stat, stats_log=None):
+    # Add one file's statistics entry to the run totals. With a stats log the
+    # entry is appended to the log instead of being kept in file_stats.
+    profile = file_stat.get('profile')
+    if profile is not None:
+        run_profile = statistics.setdefault('profile', {'wall_seconds': 0.0, 'stages': {}})
+        merge_profiles(run_profile['stages'], profile)
+    for section in COUNTER_SECTIONS:
+        if section in file_stat:
+            add_counters(statistics, section, file_stat[section])
+    for redaction_type, count in file_stat['redaction_counts'].items():
+        statistics['redaction_counts'][redaction_type] += count
+    statistics['files_processed'] += 1
+    statistics['total_redactions'] += file_stat['redactions']
+    if stats_log is not None:
+        stats_log.write(key, file_stat)
+    else:
+        statistics['file_stats'][key] = file_stat
+
+
+class StatsLog:
+    # Per-file statistics written as JSON lines while the run goes on, one
+    # {"file": ..., "redactions": ..., ...} record per file, so only the run
+    # totals are kept in memory and a crashed run leaves its records behind.
+    def __init__(self, log_path):
+        self.path = log_path
+        self.file = open(log_path, 'w', encoding='utf-8')
+
+    def write(self, key, file_stat):
+        record = {'file': key}
+        record.update(file_stat)
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def iter_stats_log(log_path):
+    # Yield (key, file_stat) for every complete record of a stats log. A last
+    # line cut short by a crash is skipped.
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            yield record.pop('file'), record
+
+
+def summarize_stats_log(log_path, file_stats=True):
+    # Build run statistics, in the format write_statistics produces, from a
+    # stats log that may have been left partially written. Without
+    # file_stats only the totals are kept.
+    statistics = {
+        'files_processed': 0,
+        'total_redactions': 0,
+        'redaction_counts': dict.fromkeys(SPAN_TYPE_STATS.values(), 0),
+        'file_stats': {},
+    }
+    for key, file_stat in iter_stats_log(log_path):
+        add_file_stat(statistics, key, file_stat)
+        if not file_stats:
+            del statistics['file_stats'][key]
+    if not file_stats:
+        del statistics['file_stats']
+    return statistics
+
+
+def warm_up(options):
+    # Load everything the enabled redactors need up front.
+    if needs_spacy(**options):
+        get_nlp()
+    if options.get('concepts'):
+        get_concept_vectors(tuple(options['concepts']))
+
+
+def handle_redaction_request(request, options):
+    # Redact the text of one server request, a JSON object with a "text" field
+    # and an optional "id" that is echoed back. The response carries the
+    # redacted text and the same per-file stats that main() reports. Returns
+    # (status, response): 400 for a malformed request and 500 when the
+    # redaction failed, with the error in the response.
+    response = {}
+    if isinstance(request, dict) and 'id' in request:
+        response['id'] = request['id']
+    if not isinstance(request, dict) or not isinstance(request.get('text'), str):
+        response['error'] = 'Request must be a JSON object with a "text" string.'
+        return 400, response
+    try:
+        text, counts = redact_text(request['text'], **options)
+    except Exception as e:
+        response['error'] = f'Redaction failed: {type(e).__name__}: {e}'
+        return 500, response
+    response['text'] = text
+    response['stats'] = build_file_stat(counts)
+    return 200, response
+
+
+def serve_stdin(options, input_stream=None, output_stream=None):
+    # Answer newline-delimited JSON requests from stdin with one JSON line each on stdout.
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'error': f'Invalid JSON: {e}'}
+        else:
+            _, response = handle_redaction_request(request, options)
+        output_stream.write(json.dumps(response) + '\n')
+        output_stream.flush()
+
+
+def make_http_handler(options):
+    # Request handler class for serve_http: POST /redact redacts a document and
+    # GET /health reports that the pipeline is loaded.
+
+    class RedactionHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/redact':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.send_json(400, {'error': 'Invalid Content-Length header.'})
+                return
+            try:
+                request = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self.send_json(400, {'error': f'Invalid JSON: {e}'})
+                return
+            self.send_json(*handle_redaction_request(request, options))
+
+        def log_message(self, format, *args):
+            pass
+
+    return RedactionHandler
+
+
+def serve_http(options, host='127.0.0.1', port=8080):
+    # Serve redaction requests over HTTP. Requests are handled one at a time on
+    # the warmed-up pipeline, since spaCy pipelines are not safe to share
+    # between threads.
+    server = HTTPServer((host, port), make_http_handler(options))
+    print(f'Serving redaction requests on http://{host}:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def new_statistics():
+    # Empty run statistics, with the sections of the enabled features.
+    statistics = {
+        'files_processed': 0,
+        'total_redactions': 0,
+        'redaction_counts': {
+            'names': 0,
+            'dates': 0,
+            'phones': 0,
+            'addresses': 0,
+            'concepts': 0,
+        },
+        'file_stats': {}  # To store per-file statistics
+    }
+    if profiling['enabled']:
+        statistics['profile'] = {'wall_seconds': 0.0, 'stages': {}}
+    if paragraph_cache is not None:
+        statistics['paragraph_cache'] = {'hits': 0, 'misses': 0}
+    if doc_cache is not None:
+        statistics['doc_cache'] = {'hits': 0, 'misses': 0}
+    if triage_settings['enabled']:
+        add_counters(statistics, 'triage', {})
+    return statistics
+
+
+def merge_statistics(parts):
+    # Combine the statistics of several runs, such as the shards of one
+    # corpus, into one of the same shape. Counts are summed; the run profile
+    # keeps the longest wall time and the largest peak memory, as the shards
+    # run side by side.
+    merged = {
+        'files_processed': 0,
+        'total_redactions': 0,
+        'redaction_counts': dict.fromkeys(SPAN_TYPE_STATS.values(), 0),
+        'file_stats': {},
+    }
+    for part in parts:
+        merged['files_processed'] += part['files_processed']
+        merged['total_redactions'] += part['total_redactions']
+        for redaction_type, count in part['redaction_counts'].items():
+            merged['redaction_counts'][redaction_type] = merged['redaction_counts'].get(redaction_type, 0) + count
+        merged['file_stats'].update(part.get('file_stats', {}))
+        if 'profile' in part:
+            profile = merged.setdefault('profile', {'wall_seconds': 0.0, 'stages': {}, 'peak_rss_bytes': 0})
+            profile['wall_seconds'] = max(profile['wall_seconds'], part['profile'].get('wall_seconds', 0.0))
+            profile['peak_rss_bytes'] = max(profile['peak_rss_bytes'], part['profile'].get('peak_rss_bytes', 0))
+            merge_profiles(profile['stages'], part['profile']['stages'])
+        for section in COUNTER_SECTIONS:
+            if section in part:
+                add_counters(merged, section, part[section])
+    return merged
+
+
+def merge_stats_main(argv):
+    # The merge-stats subcommand: combine per-shard statistics files.
+    parser = argparse.ArgumentParser(prog='redactor.py merge-stats',
+                                     description='Combine the statistics files of several shards into one.')
+    parser.add_argument('inputs', nargs='+', help='Statistics JSON files written with --stats.')
+    parser.add_argument('--stats', default='stdout',
+                        help='File or location to write the combined statistics (filename, stderr, or stdout).')
+    args = parser.parse_args(argv)
+    parts = []
+    for stats_path in args.inputs:
+        try:
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                parts.append(json.load(f))
+        except (OSError, ValueError) as e:
+            parser.error(f'cannot read {stats_path}: {e}')
+    write_statistics(merge_statistics(parts), args.stats)
+
+
+def summarize_stats_main(argv):
+    # The summarize-stats subcommand: rebuild run statistics from a stats log.
+    parser = argparse.ArgumentParser(prog='redactor.py summarize-stats',
+                                     description='Build run statistics from a (possibly partial) --stats-log file.')
+    parser.add_argument('log', help='Stats log written with --stats-log.')
+    parser.add_argument('--stats', default='stdout',
+                        help='File or location to write the statistics (filename, stderr, or stdout).')
+    parser.add_argument('--totals-only', action='store_true',
+                        help='Leave out the per-file statistics.')
+    args = parser.parse_args(argv)
+    try:
+        statistics = summarize_stats_log(args.log, file_stats=not args.totals_only)
+    except OSError as e:
+        parser.error(f'cannot read {args.log}: {e}')
+    write_statistics(statistics, args.stats)
+
+
 def write_statistics(stats, stats_output):
     stats_json = json.dumps(stats, indent=4)
     if stats_output.lower() == 'stdout':
@@ -343,14 +2927,21 @@ def write_statistics(stats, stats_output):
 
 
 def main():
+    if sys.argv[1:2] == ['merge-stats']:
+        merge_stats_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['summarize-stats']:
+        summarize_stats_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description='Redact sensitive information from text files.')
 
     # --input flag (can be repeated)
-    parser.add_argument('--input', action='append', required=True,
+    parser.add_argument('--input', action='append',
                         help='Glob pattern(s) to specify input files. Can be repeated.')
 
     # --output flag
-    parser.add_argument('--output', required=True,
+    parser.add_argument('--output',
                         help='Directory where censored files will be saved.')
 
     # Censor flags
@@ -363,11 +2954,213 @@ def main():
     parser.add_argument('--concept', action='append', help='Concept(s) to redact. Can be repeated.')
 
     # --stats flag
-    parser.add_argument('--stats', required=True,
+    parser.add_argument('--stats',
                         help='File or location to write statistics (filename, stderr, or stdout).')
 
+    # Output flags
+    parser.add_argument('--echo', action='store_true',
+                        help='Also print the redacted text of every file to stdout.')
+    parser.add_argument('--compress', choices=['same', 'none', 'gz', 'bz2', 'xz'], default='same',
+                        help='Compression of the output files ("same" compresses them like their input).')
+    parser.add_argument('--write-queue', type=int, default=8,
+                        help='Number of redacted files that may wait for the background writer '
+                             '(0 writes them synchronously).')
+
+    # --stats-log flag
+    parser.add_argument('--stats-log',
+                        help='JSON lines file the per-file statistics are appended to as files are processed; '
+                             'the --stats output then only holds the run totals.')
+
+    # --shard flag
+    parser.add_argument('--shard', type=parse_shard,
+                        help='Only redact shard i of N (i/N, counting from 0), chosen by a stable hash of each '
+                             'file path, so several hosts can split one corpus.')
+
+    # Date engine flags
+    parser.add_argument('--date-engine', choices=['auto', 'ner', 'rules'], default='auto',
+                        help='Detect dates with the spaCy NER or with whole-text rules ("auto" uses the rules '
+                             'unless names or concepts are redacted too).')
+    parser.add_argument('--date-confirm', action='store_true',
+                        help='Keep ambiguous rule-based dates such as 3/4 only when the NER also sees a date.')
+
+    # --email-headers flag
+    parser.add_argument('--email-headers', action='store_true',
+                        help='Parse email header blocks and redact their names directly, passing only the message text to spaCy.')
+
+    # --paragraph-cache flag
+    parser.add_argument('--paragraph-cache', type=int, default=0,
+                        help='Remember the spaCy results of this many paragraphs (least recently used are evicted), '
+                             'so repeated paragraphs are not parsed again.')
+
+    # Name flags
+    parser.add_argument('--name-gazetteer', action='store_true',
+                        help='Remember the person names found so far in the run and mask every later occurrence of them.')
+    parser.add_argument('--verify-names', action='store_true',
+                        help='Keep only the names spaCy finds that Google NLP also recognizes as a person.')
+
+    # Mask and span index flags
+    parser.add_argument('--mask-style', choices=MASK_STYLES, default='block',
+                        help='How censored text is written: block characters, X characters, or a tag naming '
+                             'the redaction type such as [NAME].')
+    parser.add_argument('--span-index',
+                        help='Directory where a JSON lines index of the redacted spans of every file is written.')
+    parser.add_argument('--replay',
+                        help='Directory of span indexes from an earlier run; the inputs are rendered again from '
+                             'them, in the chosen mask style, without loading any models.')
+
+    # Parse cache flags
+    parser.add_argument('--doc-cache',
+                        help='SQLite file used to keep the spaCy parse of every document across runs, so runs '
+                             'with other flags or concepts do not parse unchanged files again.')
+    parser.add_argument('--doc-cache-size', type=float, default=2048,
+                        help='Maximum size of the parse cache in megabytes (least recently used are evicted).')
+
+    # Triage flags
+    parser.add_argument('--triage', action='store_true',
+                        help='Only send spaCy the paragraphs with a sign of a name or date (capitalized words, '
+                             'date formats and words, known names).')
+    parser.add_argument('--triage-audit', type=float, default=0.0,
+                        help='Fraction of the paragraphs skipped by --triage that are parsed anyway to count '
+                             'the names and dates it missed.')
+
+    # --model flag
+    parser.add_argument('--model', default='en_core_web_lg',
+                        help='spaCy model used by the name, date and concept redactors.')
+    parser.add_argument('--vectors-mmap',
+                        help='.npy file the word vectors of the model are exported to once and memory-mapped from, '
+                             'so every redactor process on a host shares one copy.')
+
+    # Google NLP result cache flags
+    parser.add_argument('--gnlp-cache',
+                        help='SQLite file used to cache Google NLP results across runs.')
+    parser.add_argument('--gnlp-cache-size', type=int, default=100000,
+                        help='Maximum number of cached Google NLP results (least recently used are evicted).')
+    parser.add_argument('--gnlp-cache-ttl', type=float,
+                        help='Seconds after which a cached Google NLP result expires.')
+
+    # Entity request flags
+    parser.add_argument('--gnlp-backend', choices=sorted(ENTITY_BACKENDS), default='google',
+                        help='Entity service used for address detection ("local" is an offline stand-in).')
+    parser.add_argument('--gnlp-concurrency', type=int, default=8,
+                        help='Maximum number of documents waiting on entity requests at once, per process.')
+    parser.add_argument('--gnlp-qps', type=float,
+                        help='Maximum entity requests per second across all worker processes.')
+    parser.add_argument('--gnlp-retries', type=int, default=3,
+                        help='Number of retries for throttled or failed entity requests.')
+    parser.add_argument('--gnlp-timeout', type=float, default=30.0,
+                        help='Timeout in seconds for a single entity request.')
+    parser.add_argument('--gnlp-latency', type=float, default=0.0,
+                        help='Simulated latency in seconds for the local entity backend.')
+
+    # Batch processing flags
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes used to redact files in parallel.')
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help='Number of files parsed together with nlp.pipe per batch.')
+
+    # --manifest flag
+    parser.add_argument('--manifest',
+                        help='JSON manifest of file hashes and stats; unchanged files are skipped on later runs.')
+
+    # Streaming mode flags
+    parser.add_argument('--chunk-size', type=int,
+                        help='Redact files in streaming mode, reading and writing about this many characters at a time.')
+    parser.add_argument('--chunk-overlap', type=int, default=1000,
+                        help='Characters of context shared by neighbouring chunks in streaming mode.')
+
+    # Server mode flags
+    parser.add_argument('--serve', choices=['stdin', 'http'],
+                        help='Keep the pipeline loaded and redact documents sent as JSON lines on stdin or over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address the HTTP server listens on.')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port the HTTP server listens on.')
+
+    # Profiling flags
+    parser.add_argument('--profile', action='store_true',
+                        help='Add per-stage wall time, CPU time and call counts to the statistics.')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='With --profile, also track the peak memory of each stage (slower).')
+    parser.add_argument('--profile-dump',
+                        help='Write a cProfile dump of the main process to this file.')
+
     args = parser.parse_args()
-    
+    if not args.serve:
+        missing = [flag for flag, value in (('--input', args.input), ('--output', args.output), ('--stats', args.stats)) if not value]
+        if missing:
+            parser.error(f'the following arguments are required: {", ".join(missing)}')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    if not 0 <= args.triage_audit <= 1:
+        parser.error('--triage-audit must be between 0 and 1')
+    if args.doc_cache_size <= 0:
+        parser.error('--doc-cache-size must be positive')
+    if args.write_queue < 0:
+        parser.error('--write-queue must not be negative')
+    if args.paragraph_cache < 0:
+        parser.error('--paragraph-cache must not be negative')
+    if args.gnlp_concurrency < 1:
+        parser.error('--gnlp-concurrency must be at least 1')
+    if args.chunk_size is not None and args.chunk_size <= 2 * args.chunk_overlap:
+        parser.error('--chunk-size must be more than twice --chunk-overlap')
+    if args.chunk_size is not None and args.mask_style == 'type' and not args.replay:
+        parser.error('--mask-style type cannot be used with --chunk-size')
+    if args.replay and (args.serve or args.span_index):
+        parser.error('--replay cannot be used with --serve or --span-index')
+
+    configure_dates(engine=args.date_engine, confirm=args.date_confirm)
+    configure_email_parsing(headers=args.email_headers)
+    configure_paragraph_cache(args.paragraph_cache)
+    configure_triage(enabled=args.triage, audit=args.triage_audit)
+    configure_names(verify=args.verify_names)
+    configure_name_gazetteer(args.name_gazetteer)
+    configure_mask_style(args.mask_style)
+    configure_output(compression=args.compress)
+    configure_span_index(args.span_index)
+    configure_doc_cache(args.doc_cache, max_bytes=int(args.doc_cache_size * (1 << 20)))
+    # Cached parses must serve later runs with any flags, so they are made
+    # with every component a redactor can read from
+    exclude = UNUSED_COMPONENTS if args.doc_cache else pipeline_exclusions(**redaction_options(args))
+    configure_nlp(model=args.model, exclude=exclude)
+    configure_vectors(args.vectors_mmap)
+    configure_gnlp(
+        backend=args.gnlp_backend,
+        concurrency=args.gnlp_concurrency,
+        qps=args.gnlp_qps / args.workers if args.gnlp_qps else None,
+        retries=args.gnlp_retries,
+        timeout=args.gnlp_timeout,
+        latency=args.gnlp_latency,
+    )
+    configure_gnlp_cache(args.gnlp_cache, max_entries=args.gnlp_cache_size, ttl=args.gnlp_cache_ttl)
+    if args.profile or args.profile_memory:
+        configure_profiling(memory=args.profile_memory)
+
+    if args.profile_dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            run(args)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+    else:
+        run(args)
+
+
+def run(args):
+    # Redact the input files (or serve requests) as configured by the parsed command-line arguments.
+    if args.serve:
+        options = redaction_options(args)
+        warm_up(options)
+        if args.serve == 'stdin':
+            serve_stdin(options)
+        else:
+            serve_http(options, host=args.host, port=args.port)
+        return
+
     # print(args)
     # Get list of input files
     input_files = get_input_files(args.input)
@@ -376,95 +3169,128 @@ def main():
         print('No input files found. Please check the --input patterns.', file=sys.stderr)
         sys.exit(1)
 
+    # A shard may be empty; it still writes (empty) statistics to merge
+    if args.shard:
+        input_files = select_shard(input_files, args.shard)
+
     # Ensure output directory exists
     output_dir = args.output
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     # Initialize statistics
-    statistics = {
-        'files_processed': 0,
-        'total_redactions': 0,
-        'redaction_counts': {
-            'names': 0,
-            'dates': 0,
-            'phones': 0,
-            'addresses': 0,
-            'concepts': 0,
-        },
-        'file_stats': {}  # To store per-file statistics
-    }
+    statistics = new_statistics()
+    stats_log = None
+    if args.stats_log:
+        stats_log = StatsLog(args.stats_log)
+        statistics['stats_log'] = args.stats_log
+        del statistics['file_stats']
+    run_started = time.perf_counter()
+
+    if args.replay:
+        # Replay mode: render every file from its saved span index, loading no models
+        for file_path in input_files:
+            output_file_path = output_file_path_for(file_path, output_dir)
+            with collect_details() as details:
+                counts = replay_file(file_path, output_file_path, args.replay)
+            if counts is not None:
+                record_file_stats(statistics, file_path, counts, details, stats_log=stats_log)
+                print(output_file_path)
+        finish_run(statistics, args.stats, run_started, stats_log)
+        return
 
     # Process each file
-    for file_path in input_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-        except Exception as e:
-            print(f'Error reading file {file_path}: {e}', file=sys.stderr)
-            continue
+    options = redaction_options(args)
+
+    # In incremental mode, restore the stats of unchanged files from the manifest and skip them
+    manifest = None
+    if args.manifest:
+        manifest = load_manifest(args.manifest)
+        fingerprint = run_fingerprint(options)
+        input_files, unchanged_files, hashes = split_unchanged_files(input_files, output_dir, manifest, fingerprint)
+        for file_path, entry in unchanged_files:
+            record_file_stats(statistics, file_path, entry['counts'], stats_log=stats_log)
+        # The gazetteer starts with the names learned from the skipped files,
+        # as it would when every file is redacted again
+        gazetteer = manifest.get('gazetteer')
+        if gazetteer is None or gazetteer['config'] != fingerprint:
+            gazetteer = manifest['gazetteer'] = {'config': fingerprint, 'names': []}
+        learned_names = set(gazetteer['names'])
+        if name_gazetteer is not None:
+            name_gazetteer.load(learned_names)
+
+    def remember(file_path, output_file_path, counts, details):
+        if manifest is None:
+            return
+        learned_names.update(details.get('learned_names', ()))
+        if file_path in hashes:
+            manifest['files'][os.path.abspath(file_path)] = {
+                'sha256': hashes[file_path],
+                'config': fingerprint,
+                'output': output_file_path,
+                'counts': counts,
+            }
 
-        # Initialize per-file stats
-        file_stat = {
-            'redactions': 0,
-            'redaction_counts': {
-                'names': 0,
-                'dates': 0,
-                'phones': 0,
-                'addresses': 0,
-                'concepts': 0,
+    if args.chunk_size:
+        # Streaming mode: output is written chunk by chunk as the input is read
+        streamed_files = iter_streamed_files(
+            input_files,
+            output_dir,
+            options,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            overlap=args.chunk_overlap,
+        )
+        for file_path, output_file_path, counts, details in streamed_files:
+            record_file_stats(statistics, file_path, counts, details, stats_log=stats_log)
+            remember(file_path, output_file_path, counts, details)
+            print(output_file_path)
+    else:
+        processed_files = iter_processed_files(
+            input_files,
+            options,
+            workers=args.workers,
+            batch_size=args.batch_size,
+        )
+        # Files are written in the background, except when profiling so the
+        # write stage is timed with its file
+        writer = OutputWriter(max_pending=0 if profiling['enabled'] else args.write_queue)
+        try:
+            for file_path, text, counts, details in processed_files:
+                # Write censored text to output file
+                output_file_path = output_file_path_for(file_path, output_dir)
+                print(output_file_path)
+                if args.echo:
+                    print(text)
+                with collect_profile(details.get('profile')), profile_stage('write'):
+                    writer.write(output_file_path, text)
+                record_file_stats(statistics, file_path, counts, details, stats_log=stats_log)
+                remember(file_path, output_file_path, counts, details)
+        finally:
+            failed = set(writer.close())
+        if manifest is not None and failed:
+            # Files whose output was not written are redacted again next time
+            manifest['files'] = {
+                key: entry for key, entry in manifest['files'].items() if entry['output'] not in failed
             }
-        }
 
-        # Apply redaction functions based on flags
-        if args.names:
-            text, name_count = mask_names_in_text(text)
-            file_stat['redactions'] += name_count
-            file_stat['redaction_counts']['names'] += name_count
-            statistics['redaction_counts']['names'] += name_count
-
-        if args.dates:
-            text, count = redact_dates(text)
-            file_stat['redactions'] += count
-            file_stat['redaction_counts']['dates'] += count
-            statistics['redaction_counts']['dates'] += count
-
-        if args.phones:
-            text, phone_count = mask_phone_numbers_in_text(text)
-            file_stat['redactions'] += phone_count
-            file_stat['redaction_counts']['phones'] += phone_count
-            statistics['redaction_counts']['phones'] += phone_count
-
-        if args.address:
-            text, address_count = mask_detected_addresses(text)
-            file_stat['redactions'] += address_count
-            file_stat['redaction_counts']['addresses'] += address_count
-            statistics['redaction_counts']['addresses'] += address_count
-
-        # Inside main function
-        if args.concept:
-            text, concept_count = mask_concept_related_text(text, args.concept)
-            file_stat['redactions'] += concept_count
-            file_stat['redaction_counts']['concepts'] += concept_count
-            statistics['redaction_counts']['concepts'] += concept_count
-
-
-        # Update global stats
-        statistics['files_processed'] += 1
-        statistics['total_redactions'] += file_stat['redactions']
-        statistics['file_stats'][os.path.basename(file_path)] = file_stat
-
-        # Write censored text to output file
-        output_file_name = os.path.basename(file_path) + '.censored'
-        
-        output_file_path = os.path.join(output_dir, output_file_name)
-        print(output_file_path)
-        with open(output_file_path, 'w', encoding='utf-8') as f:
-            print(text)
-            f.write(text)
+    if manifest is not None:
+        gazetteer['names'] = sorted(learned_names)
+        save_manifest(args.manifest, manifest)
+
+    finish_run(statistics, args.stats, run_started, stats_log)
+
+
+def finish_run(statistics, stats_output, run_started, stats_log=None):
+    # Complete the run profile, close the stats log and write the statistics.
+    if profiling['enabled']:
+        statistics['profile']['wall_seconds'] = time.perf_counter() - run_started
+        statistics['profile']['peak_rss_bytes'] = peak_rss_bytes()
+    if stats_log is not None:
+        stats_log.close()
 
     # Write statistics
-    write_statistics(statistics, args.stats)
+    write_statistics(statistics, stats_output)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,22 @@
+import re
+
+from redactor import find_date_spans, render_masked_text, trie_regex
+
+
+def test_trie_regex_prefers_longer_words():
+    pattern = re.compile(trie_regex(["Jan", "January", "June"]))
+    assert [m.group() for m in pattern.finditer("January Jan June Jun")] == ["January", "Jan", "June"]
+
+
+def test_rule_engine_masks_email_header_dates():
+    text = "Date: Mon, 14 May 2001 16:39:00 -0700 (PDT)\nSee you Friday or in June 2001."
+    spans = find_date_spans(text, engine="rules")
+    assert render_masked_text(text, spans) == (
+        "Date: ████████████████ 16:39:00 -0700 (PDT)\nSee you ██████ or in █████████."
+    )
+
+
+def test_rule_engine_skips_impossible_numeric_dates():
+    text = "Scores were 13/13 and 5/40, the deadline is 12/31/2001."
+    spans = find_date_spans(text, engine="rules")
+    assert render_masked_text(text, spans) == "Scores were 13/13 and 5/40, the deadline is ██████████."
@@ -0,0 +1,86 @@
+import spacy
+
+from redactor import (
+    collect_details,
+    configure_doc_cache,
+    configure_nlp,
+    configure_paragraph_cache,
+    configure_triage,
+    nlp_settings,
+    parse_document,
+    redact_text,
+)
+
+
+def test_parse_cache_returns_the_saved_doc(tmp_path):
+    model_path = tmp_path / "model"
+    blank = spacy.blank("en")
+    blank.add_pipe("sentencizer")
+    blank.to_disk(model_path)
+
+    model = nlp_settings["model"]
+    configure_nlp(model=str(model_path))
+    configure_doc_cache(str(tmp_path / "docs.db"))
+    try:
+        text = "Call Jane tomorrow. She is back on Monday."
+        with collect_details() as first:
+            parsed = parse_document(text)
+        with collect_details() as second:
+            cached = parse_document(text)
+    finally:
+        configure_doc_cache(None)
+        configure_nlp(model=model)
+
+    assert first["doc_cache"] == {"misses": 1}
+    assert second["doc_cache"] == {"hits": 1}
+    assert [token.text for token in cached] == [token.text for token in parsed]
+    assert [sent.text for sent in cached.sents] == [sent.text for sent in parsed.sents]
+
+
+def test_triage_does_not_change_the_cached_parse(tmp_path):
+    model_path = tmp_path / "model"
+    spacy.blank("en").to_disk(model_path)
+
+    model = nlp_settings["model"]
+    configure_nlp(model=str(model_path))
+    configure_doc_cache(str(tmp_path / "docs.db"))
+    configure_triage(enabled=True)
+    try:
+        text = "Jane called.\n\nqty 12 14 16\n\nsee you next week"
+        with collect_details() as first:
+            redact_text(text, names=True)
+        with collect_details() as second:
+            redact_text(text, names=True, dates=True)
+    finally:
+        configure_triage(enabled=False)
+        configure_doc_cache(None)
+        configure_nlp(model=model)
+
+    assert first["doc_cache"] == {"misses": 1}
+    assert second["doc_cache"] == {"hits": 1}
+
+
+def test_paragraph_cache_does_not_change_the_cached_parse(tmp_path):
+    model_path = tmp_path / "model"
+    spacy.blank("en").to_disk(model_path)
+
+    model = nlp_settings["model"]
+    configure_nlp(model=str(model_path))
+    configure_doc_cache(str(tmp_path / "docs.db"))
+    text = "Jane called.\n\nBest regards,\nTim Belden"
+    try:
+        # The first run saw the signature in another file before this one
+        configure_paragraph_cache(100)
+        redact_text("Prices are up.\n\nBest regards,\nTim Belden", names=True)
+        with collect_details() as first:
+            redact_text(text, names=True)
+        configure_paragraph_cache(100)
+        with collect_details() as second:
+            redact_text(text, names=True, dates=True)
+    finally:
+        configure_paragraph_cache(None)
+        configure_doc_cache(None)
+        configure_nlp(model=model)
+
+    assert first["doc_cache"] == {"misses": 1}
+    assert second["doc_cache"] == {"hits": 1}
@@ -0,0 +1,52 @@
+from redactor import email_nlp_text, find_header_spans, parse_email_layout, render_masked_text
+
+EMAIL = (
+    "Message-ID: <1.JavaMail.evans@thyme>\n"
+    "Date: Mon, 14 May 2001 16:39:00 -0700 (PDT)\n"
+    "From: phillip.allen@enron.com\n"
+    "To: \"Belden, Tim\" <tim.belden@enron.com>, Jane Doe </O=ENRON/CN=JDOE>\n"
+    "Subject: Re: Gas prices\n"
+    "X-From: Phillip K Allen\n"
+    "X-Origin: Allen-P\n"
+    "\n"
+    "Prices are up.\n"
+    "\n"
+    " -----Original Message-----\n"
+    "From: \tBelden, Tim  \n"
+    "Sent:\tFriday, May 11, 2001 8:22 AM\n"
+    "\n"
+    "Prices are up.\n"
+)
+
+
+def test_header_names_are_redacted_by_parsing():
+    layout = parse_email_layout(EMAIL)
+    masked = render_masked_text(EMAIL, find_header_spans(EMAIL, layout, names=True, dates=True))
+    assert "Date: ████████████████ 16:39:00" in masked
+    assert "From: █████████████@enron.com\n" in masked
+    assert 'To: "███████████" <██████████@enron.com>, ████████ </O=ENRON/CN=████>\n' in masked
+    assert "X-From: ███████████████\nX-Origin: ███████\n" in masked
+    assert "From: \t███████████  \nSent:\t████████████████████ 8:22 AM\n" in masked
+    assert "Subject: Re: Gas prices\n" in masked
+
+
+def test_spacy_only_reads_subjects_and_new_paragraphs():
+    layout = parse_email_layout(EMAIL)
+    nlp_text = email_nlp_text(EMAIL, layout)
+    assert len(nlp_text) == len(EMAIL)
+    assert nlp_text.split() == ["Re:", "Gas", "prices", "Prices", "are", "up."]
+    assert layout.repeats == [(EMAIL.index("Prices"), EMAIL.rindex("Prices"), len("Prices are up."))]
+
+
+def test_unparsed_headers_are_left_to_spacy():
+    email = (
+        "From: phillip.allen@enron.com\n"
+        "Reply-To: Alice Walker <aw@x.com>\n"
+        "X-Assistant: Carol King\n"
+        "\n"
+        "Thanks.\n"
+    )
+    layout = parse_email_layout(email)
+    masked = render_masked_text(email, find_header_spans(email, layout, names=True))
+    assert "Reply-To: ████████████ <██@x.com>\n" in masked
+    assert email_nlp_text(email, layout).split() == ["Carol", "King", "Thanks."]
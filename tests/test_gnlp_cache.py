@@ -0,0 +1,25 @@
+from redactor import GNLPCache
+
+
+def test_gnlp_cache_evicts_least_recently_used(tmp_path):
+    cache = GNLPCache(str(tmp_path / "gnlp.sqlite"), max_entries=2)
+
+    cache.put("addresses", "first text", ["Springfield"])
+    cache.put("addresses", "second text", [])
+    # Reading the first entry makes the second one the least recently used
+    assert cache.get("addresses", "first text") == ["Springfield"]
+    cache.put("person", "John Doe", True)
+
+    assert cache.get("addresses", "second text") is None, "Expected the least recently used entry to be evicted"
+    assert cache.get("addresses", "first text") == ["Springfield"]
+    # The request type is part of the key
+    assert cache.get("addresses", "John Doe") is None
+    assert cache.get("person", "John Doe") is True
+
+
+def test_gnlp_cache_expires_entries(tmp_path):
+    cache = GNLPCache(str(tmp_path / "gnlp.sqlite"), ttl=-1)
+
+    cache.put("addresses", "some text", ["Springfield"])
+
+    assert cache.get("addresses", "some text") is None, "Expected an expired entry to be treated as missing"
@@ -0,0 +1,92 @@
+import json
+import os
+
+from redactor import (
+    configure_nlp,
+    file_sha256,
+    new_statistics,
+    nlp_settings,
+    output_file_path_for,
+    record_file_stats,
+    run_fingerprint,
+    split_unchanged_files,
+)
+
+
+def remember(manifest, file_path, output_dir, fingerprint, counts):
+    # The manifest entry run() writes for a redacted file
+    output_path = output_file_path_for(file_path, output_dir)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("redacted")
+    manifest["files"][os.path.abspath(file_path)] = {
+        "sha256": file_sha256(file_path),
+        "config": fingerprint,
+        "output": output_path,
+        "counts": counts,
+    }
+
+
+def setup_run(tmp_path, options):
+    input_path = tmp_path / "note.txt"
+    input_path.write_text("Call 555-123-4567.", encoding="utf-8")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    manifest = {"files": {}}
+    fingerprint = run_fingerprint(options)
+    remember(manifest, str(input_path), str(output_dir), fingerprint, {"phones": 1})
+    return str(input_path), str(output_dir), manifest
+
+
+def test_unchanged_files_are_skipped_with_their_stats(tmp_path):
+    options = {"phones": True}
+    input_path, output_dir, manifest = setup_run(tmp_path, options)
+    changed, unchanged, hashes = split_unchanged_files([input_path], output_dir, manifest, run_fingerprint(options))
+    assert changed == [] and [path for path, _ in unchanged] == [input_path]
+    assert hashes[input_path] == file_sha256(input_path)
+
+    statistics = new_statistics()
+    for file_path, entry in unchanged:
+        record_file_stats(statistics, file_path, entry["counts"])
+    assert statistics["files_processed"] == 1
+    assert statistics["redaction_counts"]["phones"] == 1
+
+
+def test_content_and_settings_changes_force_a_rerun(tmp_path):
+    options = {"phones": True, "concepts": ["summer"]}
+    input_path, output_dir, manifest = setup_run(tmp_path, options)
+
+    def rerun(new_options):
+        changed, _, _ = split_unchanged_files([input_path], output_dir, manifest, run_fingerprint(new_options))
+        return changed == [input_path]
+
+    assert not rerun(options)
+    assert rerun(dict(options, names=True))
+    assert rerun(dict(options, concepts=["summer", "winter"]))
+
+    with open(input_path, "a", encoding="utf-8") as f:
+        f.write(" Thanks.")
+    assert rerun(options)
+
+
+def test_model_version_change_forces_a_rerun(tmp_path):
+    model_path = tmp_path / "model"
+    model_path.mkdir()
+    (model_path / "meta.json").write_text(json.dumps({"version": "1.0.0"}))
+    model = nlp_settings["model"]
+    configure_nlp(model=str(model_path))
+    try:
+        options = {"names": True}
+        input_path, output_dir, manifest = setup_run(tmp_path, options)
+        (model_path / "meta.json").write_text(json.dumps({"version": "1.1.0"}))
+        changed, _, _ = split_unchanged_files([input_path], output_dir, manifest, run_fingerprint(options))
+    finally:
+        configure_nlp(model=model)
+    assert changed == [input_path]
+
+
+def test_missing_output_forces_a_rerun(tmp_path):
+    options = {"phones": True}
+    input_path, output_dir, manifest = setup_run(tmp_path, options)
+    os.remove(output_file_path_for(input_path, output_dir))
+    changed, unchanged, _ = split_unchanged_files([input_path], output_dir, manifest, run_fingerprint(options))
+    assert changed == [input_path] and unchanged == []
@@ -1,6 +1,6 @@
 # test_redactor.py
 
-from redactor import mask_detected_addresses
+from redactor import configure_gnlp, mask_detected_addresses
 
 def test_mask_detected_addresses():
     # Sample input text with different address formats
@@ -23,3 +23,17 @@ def test_mask_detected_addresses():
 
 
     print("Address redaction test passed.")
+
+
+def test_mask_detected_addresses_with_local_backend():
+    # The local stand-in backend lets address masking run without the Google service
+    configure_gnlp(backend="local", concurrency=1)
+    try:
+        masked_text, total_addresses_masked = mask_detected_addresses(
+            "Please visit us at 123 Main St. in Springfield or call us."
+        )
+    finally:
+        configure_gnlp(backend="google", concurrency=8)
+
+    assert total_addresses_masked == 1, f"Expected 1 address to be masked, but got {total_addresses_masked}"
+    assert masked_text == "Please visit us at ███████████████ Springfield or call us."
@@ -1,4 +1,17 @@
-from redactor import mask_concept_related_text
+import warnings
+
+import numpy
+import spacy
+
+from redactor import (
+    configure_nlp,
+    cosine_similarity_matrix,
+    detect_concept_related_sentences,
+    get_concept_vectors,
+    get_nlp,
+    mask_concept_related_text,
+    nlp_settings,
+)
 
 def test_mask_concept_related_text_simple():
     # Test for a single concept with direct match
@@ -17,3 +30,42 @@ def test_mask_concept_related_text_simple():
 
     # Check that the concept-related words are masked correctly
     assert masked_text == expected_output, "Concept masking output did not match expected output."
+
+
+def test_vectorized_scores_match_span_similarity(tmp_path):
+    model_path = tmp_path / "model"
+    blank = spacy.blank("en")
+    blank.add_pipe("sentencizer")
+    rng = numpy.random.default_rng(0)
+    for word in ["summer", "beach", "holiday", "winter", "snow", "cold", "sun"]:
+        blank.vocab.set_vector(word, rng.standard_normal(16).astype("f"))
+    blank.to_disk(model_path)
+
+    text = "Beach holiday in the sun. Cold snow all winter. Qwerty zxcv plugh. We liked summer."
+    concepts = ["holiday", "snow"]
+    model = nlp_settings["model"]
+    configure_nlp(model=str(model_path))
+    get_concept_vectors.cache_clear()
+    try:
+        nlp = get_nlp()
+        doc = nlp(text)
+        sentences = list(doc.sents)
+        concept_docs = [nlp(concept) for concept in concepts]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # Similarity of the zero vector sentence
+            expected = numpy.array([[sentence.similarity(concept) for concept in concept_docs] for sentence in sentences])
+        vectors = numpy.array([sentence.vector for sentence in sentences], dtype="float32")
+        scores = cosine_similarity_matrix(vectors, get_concept_vectors(tuple(concepts)))
+        assert numpy.allclose(scores, expected, atol=1e-6)
+        assert list(scores[2]) == [0.0, 0.0]  # No word of the third sentence has a vector
+
+        for threshold in (-0.5, 0.0, 0.2, 0.75, 1.0):
+            baseline = [
+                (sentence.start_char, sentence.end_char)
+                for sentence, row in zip(sentences, expected)
+                if any(concept in sentence.text.lower() for concept in concepts) or (row >= threshold).any()
+            ]
+            assert detect_concept_related_sentences(text, concepts, threshold=threshold, doc=doc) == baseline
+    finally:
+        get_concept_vectors.cache_clear()
+        configure_nlp(model=model)
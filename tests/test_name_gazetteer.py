@@ -0,0 +1,35 @@
+from redactor import NameGazetteer, collect_details, render_masked_text
+
+
+def test_gazetteer_masks_known_names_in_both_orders():
+    gazetteer = NameGazetteer()
+    gazetteer.learn("Belden, Tim")
+    gazetteer.learn("Emily")  # Single words are too ambiguous to learn
+
+    text = "Tim Belden wrote to Emily. Belden, Tim signed. Tim Beldens is someone else."
+    masked = render_masked_text(text, gazetteer.find_spans(text))
+    assert masked == "██████████ wrote to Emily. ███████████ signed. Tim Beldens is someone else."
+
+
+def test_gazetteer_folds_pending_names_into_one_regex():
+    gazetteer = NameGazetteer()
+    names = [f"Person Number{i}" for i in range(100)]
+    for name in names:
+        gazetteer.learn(name)
+
+    spans = gazetteer.find_spans("Hello Person Number42 and Person Number7.")
+    assert gazetteer.pending == set() and len(gazetteer.names) == 100
+    assert [(span.start, span.end) for span in spans] == [(6, 21), (26, 40)]
+
+
+def test_learned_names_are_reported_and_reloaded():
+    gazetteer = NameGazetteer()
+    with collect_details() as details:
+        gazetteer.learn("Belden, Tim")
+        gazetteer.learn("Tim Belden")
+    assert sorted(details["learned_names"]) == ["Belden, Tim", "Tim Belden"]
+
+    reloaded = NameGazetteer()
+    reloaded.load(details["learned_names"])
+    text = "Ask Tim Belden."
+    assert render_masked_text(text, reloaded.find_spans(text)) == "Ask ██████████."
@@ -0,0 +1,44 @@
+import gzip
+import os
+
+from redactor import OutputWriter, configure_output, open_text, output_file_path_for
+
+
+def test_compressed_inputs_give_compressed_outputs(tmp_path):
+    assert output_file_path_for("in/notes.txt.gz", "out") == os.path.join("out", "notes.txt.censored.gz")
+    assert output_file_path_for("in/notes.txt", "out") == os.path.join("out", "notes.txt.censored")
+    configure_output(compression="none")
+    try:
+        assert output_file_path_for("in/notes.txt.xz", "out") == os.path.join("out", "notes.txt.censored")
+    finally:
+        configure_output(compression="same")
+
+    input_path = tmp_path / "notes.txt.gz"
+    with gzip.open(input_path, "wt", encoding="utf-8") as f:
+        f.write("Call 555-123-4567.")
+    with open_text(str(input_path)) as f:
+        assert f.read() == "Call 555-123-4567."
+
+
+def test_background_writer_writes_files_atomically(tmp_path):
+    writer = OutputWriter(max_pending=2)
+    paths = [str(tmp_path / f"{i}.txt.censored.gz") for i in range(5)]
+    for i, path in enumerate(paths):
+        writer.write(path, f"text {i}")
+    writer.write(str(tmp_path / "missing" / "x.censored"), "lost")
+    assert writer.close() == [str(tmp_path / "missing" / "x.censored")]
+
+    with gzip.open(paths[3], "rt", encoding="utf-8") as f:
+        assert f.read() == "text 3"
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths)
+
+
+def test_background_writer_keeps_going_after_encoding_errors(tmp_path):
+    writer = OutputWriter(max_pending=1)
+    bad = str(tmp_path / "bad.censored")
+    for i in range(3):
+        writer.write(bad, "lone surrogate \ud800")
+    writer.write(str(tmp_path / "good.censored"), "fine")
+    assert writer.close() == [bad] * 3
+    assert (tmp_path / "good.censored").read_text(encoding="utf-8") == "fine"
+    assert os.listdir(tmp_path) == ["good.censored"]
@@ -0,0 +1,28 @@
+from redactor import ParagraphCache, Span, configure_paragraph_cache, plan_nlp, store_paragraph_spans
+
+
+def test_repeated_paragraphs_reuse_cached_spans():
+    configure_paragraph_cache(100)
+    try:
+        first = "Thanks, Jane.\n\nCall me tomorrow."
+        plan = plan_nlp(first, names=True)
+        assert len(plan.misses) == 2 and plan.cached == []
+        store_paragraph_spans(plan, [Span(8, 12, "name")])
+
+        second = "Hello there.\n\nThanks,\tJane."
+        plan = plan_nlp(second, names=True)
+        assert plan.cached == [Span(22, 26, "name")]
+        assert plan.text == "Hello there.\n\n" + " " * len("Thanks,\tJane.")
+        assert [start for start, _, _ in plan.misses] == [0]
+    finally:
+        configure_paragraph_cache(None)
+
+
+def test_paragraph_cache_evicts_least_recently_used():
+    cache = ParagraphCache(max_entries=2)
+    cache.put(b"a", ())
+    cache.put(b"b", ())
+    cache.get(b"a")
+    cache.put(b"c", ())
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == ()
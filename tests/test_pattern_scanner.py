@@ -0,0 +1,30 @@
+from redactor import render_masked_text, scan_pattern_spans
+
+
+def scan(text):
+    spans = scan_pattern_spans(text, emails=True, phones=True, addresses=True)
+    return render_masked_text(text, spans), [span.type for span in spans]
+
+
+def test_scanner_finds_every_kind_in_one_pass():
+    masked, types = scan("Write to jane.doe@enron.com, call 713-853-1234 or visit 123 Main St.")
+    assert masked == "Write to ████████@enron.com, call ████████████ or visit ████████████"
+    assert types == ["name", "phone", "address"]
+
+
+def test_email_local_part_wins_over_phone_number():
+    masked, types = scan("Mail x-555-123-4567@aol.com")
+    assert masked == "Mail ██████████████@aol.com"
+    assert types == ["name"]
+
+
+def test_long_digit_runs_are_not_phone_numbers():
+    masked, types = scan("Ref " + "1" * 10000 + " or 800-555-1234")
+    assert masked.endswith(" or ████████████")
+    assert types == ["phone"]
+
+
+def test_phone_numbers_in_email_domains_are_found():
+    masked, types = scan("Mail bob@mail-555-123-4567.example.com")
+    assert masked == "Mail ███@mail-████████████.example.com"
+    assert types == ["name", "phone"]
@@ -0,0 +1,33 @@
+from redactor import collect_profile, configure_profiling, redact_text, redaction_parses
+
+
+def test_collect_profile_records_each_stage():
+    # Every enabled stage is timed into the collected profile
+    configure_profiling(memory=True)
+    try:
+        with collect_profile() as profile:
+            text, counts = redact_text("Call 800-555-1234 today.", phones=True)
+    finally:
+        configure_profiling(enabled=False)
+
+    assert text == "Call ████████████ today."
+    assert set(profile) == {"patterns", "render"}
+    assert profile["patterns"]["calls"] == 1
+    assert profile["patterns"]["wall_seconds"] >= 0
+    assert profile["patterns"]["peak_bytes"] >= 0
+
+
+def test_collect_profile_is_off_by_default():
+    with collect_profile() as profile:
+        redact_text("Call 800-555-1234 today.", phones=True)
+    assert profile is None
+
+
+def test_documents_that_may_be_parsed_are_not_redacted_in_the_background():
+    configure_profiling()
+    try:
+        assert redaction_parses({"names": True, "address": True})
+        assert not redaction_parses({"phones": True, "address": True})
+    finally:
+        configure_profiling(enabled=False)
+    assert not redaction_parses({"names": True, "address": True})
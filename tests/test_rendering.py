@@ -0,0 +1,77 @@
+import re
+
+import spacy
+
+from redactor import MASK_CHAR, Span, apply_mask, mask_names_in_text, merge_spans, render_masked_text
+
+
+def test_overlapping_and_adjacent_spans_merge_across_types():
+    spans = [
+        Span(10, 14, "phone"),
+        Span(0, 5, "name"),
+        Span(3, 8, "date"),  # Overlaps the name
+        Span(8, 9, "address"),  # Touches the merged name and date
+        Span(20, 20, "name"),  # Empty
+    ]
+    assert merge_spans(spans) == [Span(0, 9, "name"), Span(10, 14, "phone")]
+
+    text = "abcdefghijklmnopqrstuvwxyz"
+    assert render_masked_text(text, spans) == MASK_CHAR * 9 + "j" + MASK_CHAR * 4 + text[14:]
+    assert render_masked_text(text, spans, style="x") == "XXXXXXXXXjXXXX" + text[14:]
+    assert render_masked_text(text, spans, style="type") == "[NAME]j[PHONE]" + text[14:]
+    assert render_masked_text(text, [Span(0, 3, None)], style="type") == "[REDACTED]" + text[3:]
+
+
+def test_masks_stop_at_the_first_newline():
+    text = "Regards, Tim\nBelden\nHouston"
+    assert apply_mask(text, 9, 19) == "Regards, " + MASK_CHAR * 3 + "\nBelden\nHouston"
+    assert apply_mask(text, 0, 7) == MASK_CHAR * 7 + text[7:]
+
+
+def baseline_mask_names(text, doc):
+    # The string-rewriting name redaction the span renderer replaced
+    def apply_mask(text, start_pos, end_pos):
+        segment = text[start_pos:end_pos]
+        newline_idx = segment.find("\n")
+        if newline_idx != -1:
+            end_pos = start_pos + newline_idx
+        return text[:start_pos] + "█" * (end_pos - start_pos) + text[end_pos:]
+
+    names = sorted(
+        ((ent.start_char, ent.end_char) for ent in doc.ents if ent.label_ == "PERSON"), reverse=True
+    )
+    masked_text = text
+    for start_pos, end_pos in names:
+        masked_text = apply_mask(masked_text, start_pos, end_pos)
+    offset = 0
+    for match in list(re.finditer(r"[\w\.-]+@[\w\.-]+", masked_text)):
+        start_pos, end_pos = match.start() + offset, match.end() + offset
+        local_part, domain = match.group().split("@", 1)
+        masked_email = "█" * len(local_part) + "@" + domain
+        masked_text = masked_text[:start_pos] + masked_email + masked_text[end_pos:]
+        offset += len(masked_email) - (end_pos - start_pos)
+    return masked_text, len(names) + len(list(re.finditer(r"[\w\.-]+@[\w\.-]+", text)))
+
+
+def test_span_renderer_matches_the_baseline_output():
+    text = (
+        "Tim Belden wrote to Jane Doe.\n"
+        "Jane Doe answered Tim Belden, and Tim Belden\nforwarded it.\n"
+        "Contact tim.belden@enron.com or jane.doe@enron.com.\n"
+        "Tim Belden"
+    )
+    nlp = spacy.blank("en")
+    doc = nlp(text)
+    persons = []
+    for name in ("Tim Belden\nforwarded", "Tim Belden", "Jane Doe"):
+        for match in re.finditer(re.escape(name), text):
+            span = doc.char_span(match.start(), match.end(), label="PERSON")
+            if span is not None and not any(span.start < other.end and other.start < span.end for other in persons):
+                persons.append(span)
+    doc.ents = persons
+
+    expected_text, expected_count = baseline_mask_names(text, doc)
+    masked_text, count = mask_names_in_text(text, doc=doc)
+    assert masked_text.encode("utf-8") == expected_text.encode("utf-8")
+    assert count == expected_count
+    assert "and " + MASK_CHAR * 10 + "\nforwarded it." in masked_text
@@ -0,0 +1,47 @@
+import io
+import json
+
+import redactor
+from redactor import serve_stdin
+
+
+def test_serve_stdin_answers_each_request():
+    # Newline-delimited JSON requests get one JSON response line each
+    requests = io.StringIO(
+        '{"id": 7, "text": "Call 800-555-1234 today."}\n'
+        "not json\n"
+    )
+    responses = io.StringIO()
+
+    serve_stdin({"phones": True}, input_stream=requests, output_stream=responses)
+
+    first, second = [json.loads(line) for line in responses.getvalue().splitlines()]
+    assert first["id"] == 7
+    assert first["text"] == "Call ████████████ today."
+    assert first["stats"]["redactions"] == 1
+    assert first["stats"]["redaction_counts"]["phones"] == 1
+    assert "error" in second, "Expected invalid JSON to produce an error response"
+
+
+def test_serve_stdin_reports_redaction_failures():
+    # A failing entity request is answered with an error and the loop goes on
+    def failing_backend(text, timeout=None):
+        raise ValueError("quota exceeded")
+
+    backend, retries = redactor.gnlp_settings["backend"], redactor.gnlp_settings["retries"]
+    redactor.ENTITY_BACKENDS["failing"] = failing_backend
+    redactor.configure_gnlp(backend="failing", retries=0)
+    try:
+        requests = io.StringIO(
+            '{"id": 1, "text": "Meet me at 12 Main Street."}\n'
+            '{"id": 2, "text": "Meet me at 12 Main Street."}\n'
+        )
+        responses = io.StringIO()
+        serve_stdin({"address": True}, input_stream=requests, output_stream=responses)
+    finally:
+        redactor.configure_gnlp(backend=backend, retries=retries)
+        del redactor.ENTITY_BACKENDS["failing"]
+
+    first, second = [json.loads(line) for line in responses.getvalue().splitlines()]
+    assert first["id"] == 1 and "quota exceeded" in first["error"]
+    assert second["id"] == 2 and "error" in second
@@ -0,0 +1,27 @@
+from redactor import merge_statistics, select_shard, shard_of
+
+
+def test_shards_partition_the_input_files():
+    files = [f"corpus/part{i // 10}/{i}.txt" for i in range(100)]
+    shards = [select_shard(files, (index, 4)) for index in range(4)]
+    assert sorted(sum(shards, [])) == sorted(files)
+    assert all(shards)
+    assert shard_of("corpus/./part1/12.txt", 4) == shard_of("corpus/part1/12.txt", 4)
+
+
+def test_merge_statistics_sums_the_shards():
+    def stats(name, names, dates):
+        counts = {"names": names, "dates": dates, "phones": 0, "addresses": 0, "concepts": 0}
+        file_stat = {"redactions": names + dates, "redaction_counts": counts}
+        return {
+            "files_processed": 1,
+            "total_redactions": names + dates,
+            "redaction_counts": dict(counts),
+            "file_stats": {name: file_stat},
+        }
+
+    merged = merge_statistics([stats("a.txt", 2, 1), stats("b.txt", 0, 3)])
+    assert merged["files_processed"] == 2
+    assert merged["total_redactions"] == 6
+    assert merged["redaction_counts"]["dates"] == 4
+    assert sorted(merged["file_stats"]) == ["a.txt", "b.txt"]
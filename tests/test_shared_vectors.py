@@ -0,0 +1,59 @@
+import threading
+import time
+
+import numpy
+import spacy
+
+import redactor
+from redactor import attach_shared_vectors, configure_nlp, configure_vectors, get_nlp, nlp_settings
+
+
+def test_memory_mapped_vectors_give_identical_similarities(tmp_path):
+    model_path = tmp_path / "model"
+    blank = spacy.blank("en")
+    rng = numpy.random.default_rng(0)
+    for word in ["summer", "beach", "holiday", "winter", "snow", "cold"]:
+        blank.vocab.set_vector(word, rng.standard_normal(16).astype("f"))
+    blank.to_disk(model_path)
+
+    model, exclude = nlp_settings["model"], nlp_settings["exclude"]
+    configure_nlp(model=str(model_path), exclude=())
+    try:
+        nlp = get_nlp()
+        expected = nlp("summer beach holiday").similarity(nlp("winter snow cold"))
+        configure_vectors(str(tmp_path / "vectors.npy"))
+        shared = get_nlp()
+        similarity = shared("summer beach holiday").similarity(shared("winter snow cold"))
+    finally:
+        configure_vectors(None)
+        configure_nlp(model=model, exclude=exclude)
+
+    assert isinstance(shared.vocab.vectors.data, numpy.memmap)
+    assert similarity == expected
+    assert (tmp_path / "vectors.npy.json").exists()
+
+
+def test_processes_starting_together_export_once(tmp_path, monkeypatch):
+    model_path = tmp_path / "model"
+    blank = spacy.blank("en")
+    blank.vocab.set_vector("summer", numpy.ones(16, dtype="f"))
+    blank.to_disk(model_path)
+
+    exports = []
+    export = redactor.export_vectors
+
+    def slow_export(*args):
+        exports.append(args)
+        time.sleep(0.2)
+        export(*args)
+
+    monkeypatch.setattr(redactor, "export_vectors", slow_export)
+    path = str(tmp_path / "shared" / "vectors.npy")  # Created on first export
+    models = [spacy.load(model_path) for _ in range(3)]
+    threads = [threading.Thread(target=attach_shared_vectors, args=(nlp, path)) for nlp in models]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(exports) == 1
+    assert all(isinstance(nlp.vocab.vectors.data, numpy.memmap) for nlp in models)
@@ -0,0 +1,39 @@
+from redactor import (
+    MASK_CHAR,
+    Span,
+    configure_mask_style,
+    read_span_index,
+    render_masked_text,
+    replay_file,
+    write_span_index,
+)
+
+
+def test_span_index_replays_in_another_mask_style(tmp_path):
+    text = "Call 555-123-4567 on 2024-01-05."
+    input_path = tmp_path / "note.txt"
+    input_path.write_text(text, encoding="utf-8")
+    spans = [Span(21, 31, "date", "date_rules"), Span(5, 17, "phone", "phone_pattern")]
+    counts = {"names": 0, "dates": 1, "phones": 1, "addresses": 0, "concepts": 0}
+    write_span_index(str(input_path), text, spans, counts, index_dir=str(tmp_path))
+
+    header, stored, trailer = read_span_index(str(tmp_path / "note.txt.spans.jsonl"))
+    assert header["file"] == str(input_path)
+    assert stored == sorted(spans)
+    assert trailer["counts"] == counts
+
+    configure_mask_style("type")
+    try:
+        output_path = tmp_path / "note.txt.censored"
+        assert replay_file(str(input_path), str(output_path), str(tmp_path)) == counts
+    finally:
+        configure_mask_style("block")
+    assert output_path.read_text(encoding="utf-8") == "Call [PHONE] on [DATE]."
+    assert render_masked_text(text, stored) == "Call " + MASK_CHAR * 12 + " on " + MASK_CHAR * 10 + "."
+
+
+def test_replay_skips_changed_files(tmp_path):
+    input_path = tmp_path / "note.txt"
+    input_path.write_text("Call 555-123-4567.", encoding="utf-8")
+    write_span_index(str(input_path), "Call 555-123-4568.", [Span(5, 17, "phone")], {}, index_dir=str(tmp_path))
+    assert replay_file(str(input_path), str(tmp_path / "out"), str(tmp_path)) is None
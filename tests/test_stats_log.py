@@ -0,0 +1,29 @@
+from redactor import StatsLog, record_file_stats, summarize_stats_log
+
+
+def new_totals():
+    return {
+        "files_processed": 0,
+        "total_redactions": 0,
+        "redaction_counts": {"names": 0, "dates": 0, "phones": 0, "addresses": 0, "concepts": 0},
+    }
+
+
+def test_stats_log_keeps_totals_and_summarizes_partial_logs(tmp_path):
+    log_path = tmp_path / "stats.jsonl"
+    stats_log = StatsLog(str(log_path))
+    statistics = new_totals()
+    record_file_stats(statistics, "a/notes.txt", {"names": 1, "dates": 2}, stats_log=stats_log)
+    record_file_stats(statistics, "b/notes.txt", {"phones": 3}, stats_log=stats_log)
+    stats_log.close()
+    assert statistics["total_redactions"] == 6 and "file_stats" not in statistics
+
+    summary = summarize_stats_log(str(log_path))
+    assert sorted(summary["file_stats"]) == ["a/notes.txt", "b/notes.txt"]
+    assert summary["redaction_counts"] == statistics["redaction_counts"]
+
+    # A record cut short by a crash is left out
+    log_path.write_text(log_path.read_text()[:-5])
+    summary = summarize_stats_log(str(log_path), file_stats=False)
+    assert summary["files_processed"] == 1 and summary["total_redactions"] == 3
+    assert "file_stats" not in summary
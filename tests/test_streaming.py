@@ -0,0 +1,71 @@
+import io
+import os
+import threading
+import time
+
+from redactor import iter_streamed_files, redact_stream, redact_text, stream_file
+
+
+def test_redact_stream_matches_whole_text_redaction():
+    # Phone numbers straddle many chunk boundaries when the chunks are small
+    paragraph = "Call the office at 800-555-1234 or +1 (123) 456-7890 today.\nAsk for the front desk.\n\n"
+    text = paragraph * 200
+    options = {"phones": True}
+
+    expected_text, expected_counts = redact_text(text, **options)
+    output = io.StringIO()
+    counts = redact_stream(io.StringIO(text), output, options, chunk_size=500, overlap=100)
+
+    assert output.getvalue() == expected_text, "Streaming output did not match whole-text redaction."
+    assert counts == expected_counts
+    assert counts["phones"] == 400
+
+
+def test_stream_file_names_the_side_that_failed(tmp_path, capsys):
+    input_path = tmp_path / "note.txt"
+    input_path.write_text("Call 800-555-1234.", encoding="utf-8")
+    missing_dir = tmp_path / "missing"
+
+    assert stream_file(str(input_path), str(missing_dir / "note.txt"), {"phones": True}) is None
+    assert f"Error writing file {missing_dir / 'note.txt'}" in capsys.readouterr().err
+
+    assert stream_file(str(tmp_path / "gone.txt"), str(tmp_path / "gone.out"), {"phones": True}) is None
+    assert f"Error reading file {tmp_path / 'gone.txt'}" in capsys.readouterr().err
+
+    (tmp_path / "bad.txt").write_bytes(b"Call \xff")
+    assert stream_file(str(tmp_path / "bad.txt"), str(tmp_path / "bad.out"), {"phones": True}) is None
+    assert f"Error reading file {tmp_path / 'bad.txt'}" in capsys.readouterr().err
+    assert sorted(os.listdir(tmp_path)) == ["bad.txt", "note.txt"]
+
+
+def test_streamed_workers_yield_each_file_when_it_is_done(tmp_path):
+    input_files = []
+    for i in range(3):
+        path = tmp_path / f"note{i}.txt"
+        path.write_text(f"Call 555-123-456{i}.", encoding="utf-8")
+        input_files.append(str(path))
+    # The last input only ends once the first results are in
+    fifo = str(tmp_path / "late.txt")
+    os.mkfifo(fifo)
+    input_files.append(fifo)
+    written = threading.Event()
+
+    def write_late_input():
+        time.sleep(1)
+        written.set()
+        with open(fifo, "w", encoding="utf-8") as f:
+            f.write("Call 555-123-4569.")
+
+    writer = threading.Thread(target=write_late_input)
+    writer.start()
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    try:
+        results = iter_streamed_files(input_files, str(output_dir), {"phones": True}, workers=2)
+        first = next(results)
+        assert not written.is_set()
+        rest = list(results)
+    finally:
+        writer.join()
+    assert [result[0] for result in [first] + rest] == input_files
+    assert all(result[2]["phones"] == 1 for result in [first] + rest)
@@ -0,0 +1,30 @@
+from redactor import collect_details, configure_triage, might_contain_entities, plan_nlp
+
+
+def test_triage_flags_paragraphs_that_might_hold_names_or_dates():
+    assert might_contain_entities("Please call Jane back.", names=True)
+    assert not might_contain_entities("The totals below are final.", names=True)
+    assert not might_contain_entities("12.5  13.0  11.75\n14.2  9.8  10.1", names=True)
+    assert might_contain_entities("PLEASE CALL JOHN SMITH TODAY", names=True)
+    assert might_contain_entities("Ólafur Ösp called back.", names=True)
+    assert might_contain_entities("Will called.", names=True)
+    assert might_contain_entities("thanks, May", names=True)
+    assert might_contain_entities("shipped on 3/14 as planned", date_ner=True)
+    assert might_contain_entities("see you next week", date_ner=True)
+    assert not might_contain_entities("see you there", date_ner=True)
+
+
+def test_triage_blanks_skipped_paragraphs_without_moving_offsets():
+    text = "Jane called.\n\nqty 12 14 16\nqty 18 20 22\n\nThanks."
+    configure_triage(enabled=True)
+    try:
+        with collect_details() as details:
+            plan = plan_nlp(text, names=True)
+    finally:
+        configure_triage(enabled=False)
+    table = "qty 12 14 16\nqty 18 20 22"
+    assert len(plan.text) == len(text)
+    assert plan.text.startswith("Jane called.\n\n")
+    assert plan.skipped == [(14, table), (text.index("Thanks."), "Thanks.")]
+    assert plan.text[14:14 + len(table)].isspace()
+    assert details["triage"] == {"paragraphs": 3, "skipped": 2}
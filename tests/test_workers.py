@@ -0,0 +1,39 @@
+import spacy
+
+from redactor import configure_nlp, iter_processed_files, new_statistics, nlp_settings, record_file_stats
+
+
+def run_files(input_files, options, workers):
+    statistics = new_statistics()
+    outputs = []
+    for file_path, text, counts, details in iter_processed_files(input_files, options, workers=workers, batch_size=2):
+        outputs.append((file_path, text))
+        record_file_stats(statistics, file_path, counts, details)
+    return outputs, statistics
+
+
+def test_workers_give_the_same_results_in_input_order(tmp_path):
+    model_path = tmp_path / "model"
+    spacy.blank("en").to_disk(model_path)
+    input_files = []
+    for i in range(7):
+        path = tmp_path / f"note{i}.txt"
+        path.write_text(f"Note {i}: call 555-123-{4560 + i} or mail user{i}@example.com.", encoding="utf-8")
+        input_files.append(str(path))
+    input_files.insert(3, str(tmp_path / "missing.txt"))  # Unreadable files are skipped
+
+    model = nlp_settings["model"]
+    configure_nlp(model=str(model_path))
+    try:
+        options = {"names": True, "phones": True}
+        single, single_stats = run_files(input_files, options, workers=1)
+        pooled, pooled_stats = run_files(input_files, options, workers=2)
+    finally:
+        configure_nlp(model=model)
+
+    expected_order = [path for path in input_files if not path.endswith("missing.txt")]
+    assert [file_path for file_path, _ in single] == expected_order
+    assert pooled == single
+    assert pooled_stats == single_stats
+    assert single_stats["redaction_counts"]["phones"] == 7
+    assert single_stats["redaction_counts"]["names"] == 7